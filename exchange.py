@@ -2,6 +2,10 @@ import numpy as np
 import tensorflow as tf
 import math
 from process_data.utils import *
+from process_data.bars import bars_from_records
+from process_data.cache import CACHE_DIR
+from market_data import get_market_data
+from features import WindowFeatures, lookback_offsets
 
 DATA = ".\data\BTC_USD_100_FREQ.npy"
 #DATA = ".\data\BTC-USD_VERY_SHORT.npy"
@@ -32,10 +36,13 @@ DATA = ".\data\BTC_USD_100_FREQ.npy"
 
 class Exchange:
     def __init__(self, data_stream, game_length, cash = 10000, holdings = 0, actions = [-1,1], time_interval = None,
-                 transaction_cost = 0, permit_short = False, naive_inputs = 3, naive_price_history =3):
+                 transaction_cost = 0, permit_short = False, naive_inputs = 3, naive_price_history =3, cache_dir = CACHE_DIR,
+                 gru_prime_length = None):
 
         '''
         Expects a list of dictionaries with the key price
+            data_stream is a path to a .npy file, or a MarketData that is already loaded; either way the
+            market data is read only and shared with every other Exchange on the same file
             Can control network behavior with two main parameters:
                 1. how long to look back (e.g., past hour, past day, etc.)
                 2. how often to sample prices (e.g., get price every minute, get price every hour, etc.)
@@ -49,14 +56,16 @@ class Exchange:
         self.naive_sample_pattern = [2**x for x in range(2,2+self.number_of_input_prices_for_basic)] # for naive model, which previous prices to look at;
         # will be the len of the number of input prices, we'll add the 0 later
 
-        self.data = np.load(data_stream)
-        self.vanilla_prices = self.data[:]["price"].astype('float64')
+        # Prices and everything derived from them are shared (see market_data.py); only cash, holdings and state are per exchange
+        self.market = get_market_data(data_stream, time_interval=time_interval, cache_dir=cache_dir)
+        self.data = self.market.data
+        self.vanilla_prices = self.market.vanilla_prices
         print("States in data: {}".format(len(self.vanilla_prices)))
-        self.log_prices = np.log(np.copy(self.data[:]["price"].astype("float64")))
-        self.log_price_changes = self.log_prices[1:] - self.log_prices[0:-1]
-        self.gru_prime_length = self.game_length
+        self.log_prices = self.market.log_prices
+        self.log_price_changes = self.market.log_price_changes
+        self.gru_prime_length = self.game_length if gru_prime_length is None else gru_prime_length # states primed before a game starts
 
-        min_state = min(self.naive_sample_pattern + [self.gru_prime_length, 10])  # don't start at 0, make sure we can go back in time etc.
+        min_state = max(self.naive_sample_pattern + [self.gru_prime_length, 10])  # don't start at 0: the naive look-backs and GRU priming go back this far
         max_state = len(self.log_prices) - self.game_length - 10  # give us a small buffer
         self.state_range = [min_state, max_state]
         self.state = min_state
@@ -67,15 +76,18 @@ class Exchange:
         self.holdings = holdings
         self.actions = actions
         self.transaction_cost = transaction_cost
-        self.price_changes = self.generate_log_prices(1, [0,len(self.data)]) # these are the price changes for the entire exchange
+        self.price_changes = self.market.price_changes # these are the price changes for the entire exchange
         self.price_change = self.price_changes[0]
         self.permit_short = permit_short
         self.margin_call = 0
         self.margin_requirement = 0
-        if not time_interval is None:
+        if not self.market.time_interval is None:
             # print(self.data[0:30])
-            self.generate_prices_at_time(time_interval)
+            self.bars = self.market.bars
+            self.prices_at_time = self.market.prices_at_time
             self.data = self.prices_at_time
+        self.sides = self.data["side"]
+        self.window_features = {}
 
     def reset(self):
         self.cash = self.starting_cash
@@ -83,26 +95,39 @@ class Exchange:
 
     def get_model_input(self, batch_size=1, price_range=None, exogenous=True):
         if price_range is None:
-            price_range = [self.state]
+            price_range = [self.state, self.state + self.game_length]
 
-        # This can be batched
+        # [batch x (price change, side) * steps], i.e. interleaved, for the GRU model
         if exogenous:
-            to_return = []
-            for _ in range(batch_size):
-                #prices = np.log(self.data[slice(*price_range)]["price"])
-                prices = self.generate_log_prices()
-                positions = self.data[slice(*price_range)]["side"]
-
-                combined = np.empty([prices.size + positions.size], dtype=prices.dtype)
-                combined[0::2] = prices
-                combined[1::2] = positions
-
-                to_return.append(combined)
-
-            return np.asarray(to_return)
+            inputs = self.get_model_input_batch([price_range[0]] * batch_size, price_range[1] - price_range[0], dtype="float64")
+            return inputs.reshape([batch_size, -1])
         else:
             return self.price_change, self.holdings, self.cash, self.data[self.state]["side"]
 
+    # GRU inputs for many games at once: [batch x steps x (log price change, side)]
+    # Price changes are from the previous state (0 for the first state in the data), as in generate_log_prices()
+    def get_model_input_batch(self, start_states, length, dtype="float32"):
+        self.check_steps(start_states, length)
+        steps = np.asarray(start_states)[:, None] + np.arange(length)
+        inputs = np.empty(steps.shape + (2,), dtype=dtype)
+        inputs[:, :, 0] = self.market.get_pyramid().returns(steps, 1)
+        inputs[:, :, 1] = self.sides[steps]
+        return inputs
+
+    def check_steps(self, start_states, length):
+        # negative steps would silently wrap around to the end of the data, and steps past it would fail further down
+        first, last = int(np.min(start_states)), int(np.max(start_states)) + length
+        if first < 0 or last > len(self.sides):
+            raise ValueError("Steps [{}, {}) are outside the {} states in the data".format(first, last, len(self.sides)))
+
+    # Priming window [start - prime_length, start) and game window [start, start + game_length) for every start state,
+    # gathered in one go; both are [batch x steps x inputs] views of the same array
+    def get_gru_inputs(self, start_states, prime_length, game_length=None, dtype="float32"):
+        if game_length is None:
+            game_length = self.game_length
+        inputs = self.get_model_input_batch(np.asarray(start_states) - prime_length, prime_length + game_length, dtype=dtype)
+        return inputs[:, :prime_length], inputs[:, prime_length:]
+
     def generate_log_prices(self, distance=1, state_range=None):
         # distance - comparison price; e.g. 5 implies compare this price to the price 5 transactions ago
         # 1 is the previous price
@@ -120,9 +145,9 @@ class Exchange:
                 state_range = [self.state, self.state + self.game_length]  # generate price changes for game
         backsteps = min(distance, state_range[0]) # can't go before beginning of time
         state_range = [x - backsteps for x in state_range]
-        price_changes = np.log(self.data[slice(*state_range)]["price"].astype('float64')*1.0) #np.log
-        # print(type(price_changes))
-        price_changes = price_changes[distance:] - price_changes[:-distance]
+        # log price now minus log price distance states ago, looked up from the precomputed log prices
+        steps = np.arange(state_range[0] + distance, state_range[1])
+        price_changes = self.market.get_pyramid().returns(steps, distance)
 
 
         price_changes = np.insert(price_changes, 0, [0] * (distance-backsteps)) # no change for first state;
@@ -142,7 +167,7 @@ class Exchange:
 
     def goto_state(self, state):
         self.state = state
-        self.current_price = self.data[self.state]["price"]
+        self.current_price = float(self.data[self.state]["price"]) # not the data's float16, which would round the trades
         return self.data[self.state]
 
     def is_terminal_state(self):
@@ -214,24 +239,39 @@ class Exchange:
             # Override default freq
             # There are two frequencies -- one is the frequency of previous time steps (e.g. for the naive model)
             # Other frequency is the comparison price for % change calculation - kind of a gradient over that period
-            price_indices = self.get_batch_price_indices(state_range=state_range, freq=freq, backsamples=backsamples)
+            # Same as indexing prices with get_batch_price_indices, but through sliding window views (see features.py)
+            if state_range is None:
+                state_range = [self.state, self.state + self.game_length]
+            windows = self.get_window_features(prices, freq, backsamples)
 
             # Constant shift
             #comparison_prices_for_game = self.get_batch_prices(prices=self.log_prices, state_range=state_range-freq, freq=freq, backsamples=backsamples)
             # (prices_for_game - comparison_prices_for_game)[:, None]
             # Relative shift:
             if not calc_diff:
-                return prices[price_indices]
+                return windows.raw(state_range[0], state_range[1] - state_range[0])
             else:
-                return prices[price_indices][:,0:-1] - prices[price_indices][:,1:]
+                return windows.diff(state_range[0], state_range[1] - state_range[0])
+
+    def get_window_features(self, series, freq, backsamples=None):
+        # One WindowFeatures per series and look-back pattern, built on first use. The entry holds on to its series, so
+        # the id can't be reused by another array while it is cached; checking the entry's series is cheap insurance
+        if backsamples is None:
+            backsamples = self.number_of_input_prices_for_basic
+        offsets = lookback_offsets(freq, backsamples)
+        key = (id(series), tuple(offsets))
+        entry = self.window_features.get(key)
+        if entry is None or entry.series is not series:
+            entry = self.window_features[key] = WindowFeatures(series, offsets)
+        return entry
 
     def get_model_input_naive(self):
         # this uses current state
 
         prices = self.get_price_history(freq=self.naive_sample_pattern, batch= True, )[None,...]
         if self.number_of_input_types == 2:
-            buy_sell_indices = self.get_batch_price_indices(state_range = None, freq=self.naive_sample_pattern, ) [:,:-1] # n-1 in prices since using the difference
-            buy_sell = self.data[:]["side"][buy_sell_indices] [None,...] # add a batch dimension
+            buy_sell = self.get_window_features(self.sides, self.naive_sample_pattern).raw(self.state, self.game_length)[:,:-1] # n-1 in prices since using the difference
+            buy_sell = buy_sell[None,...] # add a batch dimension
             input = np.concatenate((prices,buy_sell), 2) #[1 (batches x seq length x prev_states * 2)] ; 2 is for prices and sides
         else:
             input = prices
@@ -239,6 +279,21 @@ class Exchange:
         #basic = (basic - np.mean(basic)) #/(np.max(basic)-np.min(basic)) # normalize
         return input
 
+    # Look-back returns/volatility/range over several distances for many games at once: [batch x game length x features]
+    # kinds - any of "return", "volatility", "range"; distances default to the naive sample pattern
+    def get_multiscale_features(self, start_states, distances=None, kinds=("return",), dtype="float32"):
+        if distances is None:
+            distances = self.naive_sample_pattern
+        return self.market.get_pyramid().features(start_states, self.game_length, distances, kinds=kinds, dtype=dtype)
+
+    # get_model_input_naive for many starting states at once: [batch x game length x inputs]
+    def get_model_input_naive_batch(self, start_states, dtype="float64"):
+        prices = self.get_window_features(self.log_prices, self.naive_sample_pattern).diff_batch(start_states, self.game_length, dtype=dtype)
+        if self.number_of_input_types == 2:
+            buy_sell = self.get_window_features(self.sides, self.naive_sample_pattern).raw_batch(start_states, self.game_length, dtype=dtype)[:,:,:-1]
+            return np.concatenate((prices, buy_sell), 2)
+        return prices
+
     # same as above, but can optionally define a list [0,10,50,100] of previous time steps, or a function
     def get_price_history_func(self, current_id = None, n = 100, pattern=lambda x: x**2):
         if type(pattern) == type([]):
@@ -252,34 +307,17 @@ class Exchange:
         return np.copy(self.data[pattern]["price"])
 
     # look at prices every X seconds (rather than each transaction as a new state)
+    # Each bar is represented by its first transaction; empty bars repeat the previous bar (or are None/NaN)
     def generate_prices_at_time(self, seconds = 60, prices_only = False, interpolation = "repeat"):
-        current_time = self.data[0]["time"]
-        target = round_to_nearest(current_time, round_by=seconds)
-        previous_target = target
-        self.prices_at_time = [0]
-
-        for n, i in enumerate(self.data):
-            if i["time"] > target:
-                target = round_to_nearest(i["time"], seconds)
-                time_steps = int((target-previous_target)/seconds ) # number of missing time intervals
-
-                # Return list of prices only or index of complete transactions
-                next_item = [n] if not prices_only else [i["price"]]
-
-                # Interpolation if no transactions in interval
-                if interpolation == "repeat":
-                    self.prices_at_time += [self.prices_at_time[-1]]*time_steps + next_item
-                elif interpolation is None:
-                    self.prices_at_time += [None] * time_steps + next_item
-
-                previous_target = target
-                target += seconds
-
-        self.prices_at_time.pop(0)
+        self.bars = bars_from_records(self.data, seconds=seconds, interpolation=interpolation)
 
-        if not prices_only:
-            #print(self.prices_at_time[0:30])
-            self.prices_at_time = np.copy(self.data[self.prices_at_time])
+        # Return list of prices only or complete transactions
+        if prices_only:
+            self.prices_at_time = self.bars["open"]
+        elif interpolation is None:
+            raise ValueError("Empty bars have no transaction to return; use prices_only with interpolation=None")
+        else:
+            self.prices_at_time = np.copy(self.data[self.bars["trade"]])
 
     def buy_security(self, coin = None, currency = None):
         assert (coin is None) != (currency is None)
@@ -321,7 +359,7 @@ class Exchange:
 
     def interpret_action(self, action, sd, continuous = True, sample = True):
         # this normalizes action to [min, max]
-        raw_action = action
+        raw_action = float(action) # e.g. the model's float32 actions; NumPy 2 would do the whole trade in float32
         if continuous:
             # action = 2*(action-np.average(self.actions))/(max(self.actions)-min(self.actions))
             if sample:
@@ -349,6 +387,213 @@ class Exchange:
         sample = np.random.normal(mean, sd)
         return sample
 
+    # Play a whole game from a precomputed action vector
+    # Gives exactly what calling interpret_action(action, sd, sample=False) and get_next_state() for every action would,
+    # but runs as one tight loop over plain floats instead of per step method calls and numpy scalars.
+    # Cash depends on every earlier (rounded) trade, so there is no closed form; this is a scan.
+    # liquidate_each_step - also call interpret_action(-1) after each step, like the EXPERIMENT mode in Worker
+    # Returns prices traded at, portfolio values and rewards after each step, and the actions interpret_action would return
+    def simulate_game(self, actions, start_state = None, liquidate_each_step = False):
+        if not start_state is None:
+            self.goto_state(start_state)
+        actions = np.asarray(actions, dtype="float64").reshape(-1)
+        steps = len(actions)
+        # round off, put action in acceptable range, in float64 as interpret_action does
+        rounded_actions = np.round(np.clip(actions, -1, 1), 2).tolist()
+        raw_actions = actions.tolist()
+
+        next_prices = self.vanilla_prices[self.state + 1:self.state + steps + 1].tolist()
+        prices = [float(self.current_price)] + next_prices[:-1]
+        portfolio_values = [0.] * steps
+        rewards = [0.] * steps
+        chosen_actions = [0.] * steps
+
+        cash, holdings = self.cash, self.holdings
+        tc, short = self.transaction_cost, self.permit_short
+        margin_value = self.margin_call * self.starting_cash
+        margin_requirement = self.margin_requirement * self.starting_cash
+
+        # Prices are numpy floats, so interpret_action etc. round like np.round (scale, round half to even, unscale)
+        def round2(x):
+            return round(x * 100.) / 100.
+
+        def round5(x):
+            return round(x * 1e5) / 1e5
+
+        # Same rules as interpret_action/buy_security/sell_security; returns cash, holdings and whether there was a margin call
+        def trade(cash, holdings, price, action):
+            if short and cash + holdings*price < margin_value and holdings < 0:
+                cost = min(cash, price * -holdings)
+                coins = round2((cost * (1-tc)) / price)
+                return cash - coins * price * (1+tc), holdings + coins, True
+            if action < 0:
+                if not short:
+                    proceeds = min(holdings*price, holdings * abs(action)*price)
+                else:
+                    proceeds = (((cash + holdings*price) - margin_requirement)/price) * abs(action) * price
+                coins = round2(proceeds/price)
+                cash += coins * price * (1-tc)
+                holdings -= coins
+            elif action > 0:
+                cost = min(cash, cash * abs(action))
+                coins = round2((cost * (1-tc)) / price)
+                cash -= coins * price * (1+tc)
+                holdings += coins
+            return cash, holdings, False
+
+        previous_value = cash + holdings*self.current_price
+        for i in range(steps):
+            cash, holdings, margin_called = trade(cash, holdings, prices[i], rounded_actions[i])
+            chosen_actions[i] = rounded_actions[i] if margin_called else raw_actions[i]
+
+            # next state
+            price = next_prices[i]
+            cash = round5(cash)
+            holdings = round5(holdings)
+            value = cash + holdings*price
+            portfolio_values[i] = value
+            rewards[i] = value - previous_value
+            previous_value = value
+
+            if liquidate_each_step:
+                cash, holdings, _ = trade(cash, holdings, price, -1.)
+
+        self.cash, self.holdings = cash, holdings
+        self.state += steps
+        self.current_price = self.vanilla_prices[self.state]
+        self.price_change = self.price_changes[self.state]
+        return np.asarray(prices), np.asarray(portfolio_values), np.asarray(rewards), np.asarray(chosen_actions)
+
+    def get_status(self):
+        print("Cash {}, Holdings {}, Price {}, State {}".format(self.cash, self.holdings, self.current_price, self.state))
+
+# N independent games stepped in lock-step; cash, holdings and state (the cursor) are arrays with one entry per game
+# Trading rules are the same as Exchange -- coins are rounded to 2 places, cash/holdings to 5 places every step,
+# transaction costs, shorting and margin calls work the same way -- but all games are handled in one numpy pass
+# Prices always come from vanilla_prices, i.e. the price at each trade
+class VectorizedExchange:
+    def __init__(self, data_stream, game_length, number_of_games, cash = 10000, holdings = 0, time_interval = None,
+                 transaction_cost = 0, permit_short = False, cache_dir = CACHE_DIR):
+        self.market = get_market_data(data_stream, time_interval=time_interval, cache_dir=cache_dir)
+        self.prices = self.market.vanilla_prices
+        self.price_changes = self.market.price_changes
+        self.game_length = game_length
+        self.number_of_games = number_of_games
+        self.state_range = [10, len(self.prices) - self.game_length - 10]
+
+        self.starting_cash = cash
+        self.starting_holdings = holdings
+        self.transaction_cost = transaction_cost
+        self.permit_short = permit_short
+        self.margin_call = 0
+        self.margin_requirement = 0
+
+        self.reset()
+        self.goto_state(self.state_range[0])
+
+    def reset(self):
+        self.cash = np.full(self.number_of_games, self.starting_cash, dtype="float64")
+        self.holdings = np.full(self.number_of_games, self.starting_holdings, dtype="float64")
+
+    def goto_state(self, states):
+        # states - one starting state per game, or a single state for all of them
+        self.state = np.broadcast_to(np.asarray(states, dtype="int64"), (self.number_of_games,)).copy()
+        self.current_price = self.prices[self.state]
+        self.price_change = self.price_changes[self.state]
+        return self.state
+
+    def random_states(self):
+        return np.random.randint(*self.state_range, size=self.number_of_games)
+
+    def get_next_state(self):
+        self.state += 1
+        self.current_price = self.prices[self.state]
+        self.price_change = self.price_changes[self.state]
+
+        # Round off
+        self.cash = np.round(self.cash, 5)
+        self.holdings = np.round(self.holdings, 5)
+        return self.state
+
+    def buy_security(self, coin = None, currency = None, mask = None):
+        # mask - which games trade; the others are left alone
+        assert (coin is None) != (currency is None)
+
+        if currency is None:
+            cost = np.minimum(self.cash, self.current_price * coin)
+        else:
+            cost = np.minimum(self.cash, currency)
+
+        # buy an even amount of coins
+        coins_bought = np.round((cost * (1-self.transaction_cost)) / self.current_price, 2)
+        if mask is not None:
+            coins_bought = np.where(mask, coins_bought, 0)
+        self.cash = self.cash - coins_bought * self.current_price * (1+self.transaction_cost)
+        self.holdings = self.holdings + coins_bought
+
+    def sell_security(self, coin = None, currency = None, mask = None):
+        assert (coin is None) != (currency is None)
+
+        if coin is None:
+            proceeds = np.minimum(self.holdings*self.current_price, currency) if not self.permit_short else currency
+        else:
+            proceeds = np.minimum(self.holdings*self.current_price, coin*self.current_price) if not self.permit_short else coin*self.current_price
+
+        coins_sold = np.round(proceeds/self.current_price, 2)
+        if mask is not None:
+            coins_sold = np.where(mask, coins_sold, 0)
+        self.cash = self.cash + coins_sold * self.current_price * (1-self.transaction_cost)
+        self.holdings = self.holdings - coins_sold
+
+    def get_value(self):
+        return self.cash + self.holdings*self.current_price
+
+    def interpret_action(self, actions, sd = 0, continuous = True, sample = True):
+        # actions - one action per game in [-1, 1]; see Exchange.interpret_action
+        raw_actions = np.broadcast_to(np.asarray(actions, dtype="float64"), (self.number_of_games,))
+        if continuous and sample:
+            raw_actions = np.random.normal(raw_actions, sd)
+        actions = np.round(np.clip(raw_actions, -1, 1), 2) # round off, put action in acceptable range
+
+        # Margin call -- close all negative positions instead of acting
+        margin_called = np.zeros(self.number_of_games, dtype=bool)
+        if self.permit_short:
+            margin_called = (self.get_value() < self.margin_call*self.starting_cash) & (self.holdings < 0)
+            self.buy_security(coin=-self.holdings, mask=margin_called)
+
+        selling = ~margin_called & (actions < 0)
+        buying = ~margin_called & (actions > 0)
+        if not self.permit_short:
+            self.sell_security(coin = self.holdings * abs(actions), mask=selling)
+        else: # can short all but margin_requirement of the initial balance
+            self.sell_security(coin=((self.get_value() - self.margin_requirement*self.starting_cash)/self.current_price) * abs(actions), mask=selling)
+        self.buy_security(currency = self.cash * abs(actions), mask=buying)
+
+        # don't tell the model we rounded the recommendation (except on a margin call, like Exchange)
+        return np.where(margin_called, actions, raw_actions)
+
+    # Exchange.simulate_game for every game at once; actions is [games x steps]
+    def simulate_games(self, actions, start_states = None, liquidate_each_step = False):
+        if not start_states is None:
+            self.goto_state(start_states)
+        actions = np.asarray(actions, dtype="float64").reshape(self.number_of_games, -1)
+        steps = actions.shape[1]
+
+        prices = np.empty((self.number_of_games, steps))
+        portfolio_values = np.empty((self.number_of_games, steps))
+        chosen_actions = np.empty((self.number_of_games, steps))
+        previous_value = self.get_value()
+        for i in range(steps):
+            prices[:, i] = self.current_price
+            chosen_actions[:, i] = self.interpret_action(actions[:, i], sample=False)
+            self.get_next_state()
+            portfolio_values[:, i] = self.get_value()
+            if liquidate_each_step:
+                self.interpret_action(-1, sample=False)
+
+        rewards = np.diff(portfolio_values, axis=1, prepend=previous_value[:, None])
+        return prices, portfolio_values, rewards, chosen_actions
+
     def get_status(self):
         print("Cash {}, Holdings {}, Price {}, State {}".format(self.cash, self.holdings, self.current_price, self.state))
 
@@ -374,6 +619,45 @@ def test_getting_prices(myExchange):
     # DOUBLE CHECK THIS IS RIGHT
     print(myExchange.get_model_input_naive())
 
+def play_step_by_step(myExchange, actions, start_state, liquidate_each_step = False):
+    # One action at a time, as Worker.play_game2 used to do it; simulate_game should give the same portfolio values,
+    # rewards and chosen actions (see test_exchange.py)
+    myExchange.goto_state(start_state)
+    previous_value = myExchange.get_value()
+    step_values, step_rewards, chosen_actions = [], [], []
+    for action in actions:
+        chosen_actions.append(myExchange.interpret_action(action, 0, sample = False))
+        myExchange.get_next_state()
+        current_value = myExchange.get_value()
+        step_values.append(current_value)
+        step_rewards.append(current_value - previous_value)
+        previous_value = current_value
+        if liquidate_each_step:
+            myExchange.interpret_action(-1, 0, sample = False)
+    return np.asarray(step_values), np.asarray(step_rewards), np.asarray(chosen_actions)
+
+def benchmark_simulate_game(data = DATA, t_max = 1000, repeats = 10, liquidate_each_step = True):
+    # Step by step vs. simulate_game on the same random actions
+    import time
+    myExchange = Exchange(data, t_max)
+    actions = np.random.uniform(-1, 1, t_max)
+    start_state = myExchange.state_range[0]
+
+    start = time.time()
+    for _ in range(repeats):
+        myExchange.reset()
+        play_step_by_step(myExchange, actions, start_state, liquidate_each_step)
+    step_time = (time.time() - start) / repeats
+
+    start = time.time()
+    for _ in range(repeats):
+        myExchange.reset()
+        myExchange.simulate_game(actions, start_state = start_state, liquidate_each_step = liquidate_each_step)
+    simulate_time = (time.time() - start) / repeats
+
+    print("t_max {}: step by step {:.2f}ms, simulate_game {:.2f}ms ({:.1f}x)".format(t_max, step_time*1000, simulate_time*1000, step_time/simulate_time))
+    return step_time, simulate_time
+
 def play_game_simple():
     myExchange = Exchange(DATA, 1000, permit_short=True)
 
@@ -0,0 +1,148 @@
+import numpy as np
+import threading
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Sliding window features over a 1-D series (log prices, sides, ...) without building index matrices.
+# A look-back pattern is a list of offsets like [0, -4, -8, -16]; the feature for step t and column j is
+#   series[t + offsets[j]]                              (raw)
+#   series[t + offsets[j]] - series[t + offsets[j+1]]   (diff)
+# which is what Exchange.get_batch_price_indices / get_price_history compute with np.tile and fancy indexing.
+
+def lookback_offsets(freq, backsamples=None):
+    # Same conventions as Exchange.get_batch_price_indices
+    # freq is either a list of look-backs, e.g. [4, 8, 16] (a 0 is added in front), or one frequency used backsamples times
+    if isinstance(freq, (list, tuple, np.ndarray)):
+        if freq[0] != 0:
+            return np.insert(0 - np.array(freq), 0, 0)
+        return np.asarray(freq)
+    return np.arange(0, -freq * backsamples - 1, -freq)
+
+class WindowFeatures:
+    def __init__(self, series, offsets):
+        self.series = series
+        self.offsets = np.asarray(offsets, dtype="int64")
+        self.furthest_back = -int(self.offsets.min())
+        steps = np.diff(self.offsets)
+        # evenly spaced look-backs can be a single strided view
+        self.constant_step = int(steps[0]) if len(steps) and (steps == steps[0]).all() and steps[0] < 0 else None
+        self.all_windows = sliding_window_view(series, self.furthest_back + 1) # all_windows[k] = series[k:k + furthest_back + 1]
+        self.columns = self.furthest_back + self.offsets
+        self.game_windows = {}
+
+    def check_starts(self, starts):
+        # a look-back before the start of the series would silently wrap around to its end
+        first = int(np.min(starts))
+        if first < self.furthest_back:
+            raise ValueError("Start state {} is less than the {} states the look-backs need".format(first, self.furthest_back))
+
+    def lagged(self, start, length):
+        # one read only view per offset, series[start + offset: start + offset + length]
+        self.check_starts(start)
+        return [self.series[start + offset:start + offset + length] for offset in self.offsets]
+
+    def raw(self, start, length):
+        # [length x len(offsets)]; a view when the look-backs are evenly spaced, otherwise one gather
+        self.check_starts(start)
+        windows = self.all_windows[start - self.furthest_back:start - self.furthest_back + length]
+        if self.constant_step is not None:
+            return windows[:, self.furthest_back::self.constant_step]
+        return windows[:, self.columns]
+
+    def diff(self, start, length, out=None, dtype=None):
+        # [length x len(offsets)-1]
+        if out is None:
+            out = np.empty((length, len(self.offsets) - 1), dtype=dtype or self.series.dtype)
+        lagged = self.lagged(start, length)
+        for j in range(len(self.offsets) - 1):
+            np.subtract(lagged[j], lagged[j + 1], out=out[:, j], casting="unsafe")
+        return out
+
+    def games(self, length):
+        # games(length)[s] is a read only view of series[s:s + length]
+        if length not in self.game_windows:
+            self.game_windows[length] = sliding_window_view(self.series, length)
+        return self.game_windows[length]
+
+    def raw_batch(self, starts, length, dtype=None):
+        # [batch x length x len(offsets)] for many starting states at once
+        starts = np.asarray(starts)
+        self.check_starts(starts)
+        games = self.games(length)
+        out = np.empty((len(starts), length, len(self.offsets)), dtype=dtype or self.series.dtype)
+        for j, offset in enumerate(self.offsets):
+            out[:, :, j] = games[starts + offset]
+        return out
+
+    def diff_batch(self, starts, length, dtype=None):
+        # [batch x length x len(offsets)-1]
+        starts = np.asarray(starts)
+        self.check_starts(starts)
+        games = self.games(length)
+        out = np.empty((len(starts), length, len(self.offsets) - 1), dtype=dtype or self.series.dtype)
+        previous = games[starts + self.offsets[0]]
+        for j in range(len(self.offsets) - 1):
+            current = games[starts + self.offsets[j + 1]]
+            np.subtract(previous, current, out=out[:, :, j], casting="unsafe")
+            previous = current
+        return out
+
+# Multi-resolution look-back features over log prices, all constant time per (step, distance):
+#   return(t, d)     = log p[t] - log p[t-d]
+#   volatility(t, d) = sqrt(sum of squared one step log returns over (t-d, t])    -- from a running sum
+#   range(t, d)      = max - min of log p over [t-d, t]                          -- from power-of-two max/min levels
+# Build once per dataset (MarketData.get_pyramid) and gather whole [batch x steps x features] tensors with features()
+# Look-backs that would go before the start of the data are clipped to the first price
+class ReturnPyramid:
+    def __init__(self, log_prices, levels=0):
+        self.log_prices = log_prices
+        squared_returns = np.square(np.diff(log_prices, prepend=log_prices[:1]))
+        self.squared_return_index = np.cumsum(squared_returns) # running sum, index[0] = 0
+        self.highs = [log_prices]
+        self.lows = [log_prices]
+        self.lock = threading.Lock()
+        self.add_levels(levels)
+
+    def add_levels(self, levels):
+        # level k holds max/min of log p[i:i + 2**k]
+        with self.lock:
+            while len(self.highs) <= levels:
+                half = 2 ** (len(self.highs) - 1)
+                self.highs.append(np.maximum(self.highs[-1][:-half], self.highs[-1][half:]))
+                self.lows.append(np.minimum(self.lows[-1][:-half], self.lows[-1][half:]))
+
+    def back(self, t, d):
+        return np.maximum(np.asarray(t) - d, 0)
+
+    def returns(self, t, d):
+        return self.log_prices[t] - self.log_prices[self.back(t, d)]
+
+    def volatility(self, t, d):
+        index = self.squared_return_index
+        return np.sqrt(np.maximum(index[t] - index[self.back(t, d)], 0)) # running sums can be off by an ulp
+
+    def range(self, t, d):
+        start = self.back(t, d)
+        length = np.asarray(t) - start + 1
+        level = np.floor(np.log2(length)).astype("int64")
+        self.add_levels(int(level.max()))
+        # two overlapping power-of-two blocks cover [start, t]
+        high = np.empty(np.broadcast(start, level).shape)
+        low = np.empty(high.shape)
+        start, end, level = np.broadcast_arrays(start, np.asarray(t) - 2 ** level + 1, level)
+        for k in np.unique(level):
+            mask = level == k
+            high[mask] = np.maximum(self.highs[k][start[mask]], self.highs[k][end[mask]])
+            low[mask] = np.minimum(self.lows[k][start[mask]], self.lows[k][end[mask]])
+        return high - low
+
+    def features(self, starts, length, distances, kinds=("return",), dtype="float32"):
+        # [batch x length x (len(kinds) * len(distances))], columns grouped by kind
+        t = (np.asarray(starts)[:, None] + np.arange(length))[:, :, None]
+        d = np.asarray(distances)[None, None, :]
+        functions = {"return": self.returns, "volatility": self.volatility, "range": self.range}
+        out = np.empty((t.shape[0], length, len(kinds) * len(distances)), dtype=dtype)
+        for n, kind in enumerate(kinds):
+            if kind not in functions:
+                raise ValueError("Unknown feature {}".format(kind))
+            out[:, :, n * len(distances):(n + 1) * len(distances)] = functions[kind](t, d)
+        return out
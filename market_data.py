@@ -0,0 +1,73 @@
+import numpy as np
+import os
+import threading
+from process_data.bars import bars_from_records
+from process_data.cache import load_or_build, CACHE_DIR
+from features import ReturnPyramid
+
+# Read only market data shared by every Exchange.
+# The raw trades and the cached derived arrays are memory mapped, so exchanges in one process share a single
+# MarketData object and exchanges in different processes share the same pages through the OS page cache.
+# An Exchange only keeps its own cash, holdings and state (the cursor) on top of this.
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+class MarketData:
+    def __init__(self, data_stream, time_interval=None, cache_dir=CACHE_DIR):
+        self.path = data_stream
+        self.time_interval = time_interval
+        self.data = np.load(data_stream, mmap_mode="r")
+
+        derived = load_or_build(data_stream, {"time_interval": time_interval, "distance": 1, "dtype": "float64"},
+                                self.build_derived_arrays, cache_dir=cache_dir)
+        for array in derived.values():
+            array.flags.writeable = False
+
+        self.vanilla_prices = derived["vanilla_prices"]
+        self.log_prices = derived["log_prices"]
+        self.log_price_changes = derived["log_price_changes"]
+        self.price_changes = derived["price_changes"] # log price change from the previous trade, 0 for the first one
+        self.bars = derived.get("bars")
+        self.prices_at_time = derived.get("prices_at_time")
+        self.state_log_prices = derived.get("state_log_prices", self.log_prices) # log prices of the states (trades or bars)
+        self.pyramid = None
+        self.pyramid_lock = threading.Lock()
+
+    def build_derived_arrays(self):
+        # Everything computed from the raw data at startup; the result is what gets cached
+        derived = {}
+        derived["vanilla_prices"] = self.data[:]["price"].astype('float64')
+        derived["log_prices"] = np.log(derived["vanilla_prices"])
+        derived["log_price_changes"] = derived["log_prices"][1:] - derived["log_prices"][0:-1]
+        derived["price_changes"] = np.insert(derived["log_price_changes"], 0, 0)
+        if not self.time_interval is None:
+            derived["bars"] = bars_from_records(self.data, seconds=self.time_interval, interpolation="repeat")
+            derived["prices_at_time"] = np.copy(self.data[derived["bars"]["trade"]])
+            derived["state_log_prices"] = np.log(derived["prices_at_time"]["price"].astype('float64'))
+        return derived
+
+    def get_pyramid(self, levels=0):
+        # Look-back return/volatility/range index over the states' log prices, built on first use
+        with self.pyramid_lock:
+            if self.pyramid is None:
+                self.pyramid = ReturnPyramid(self.state_log_prices)
+        self.pyramid.add_levels(levels)
+        return self.pyramid
+
+    @property
+    def states(self):
+        # what an Exchange steps through -- trades, or time bars if a time_interval was given
+        return self.data if self.time_interval is None else self.prices_at_time
+
+def get_market_data(data_stream, time_interval=None, cache_dir=CACHE_DIR):
+    # One MarketData per (file, time_interval) per process; a MarketData that is already loaded is used as is
+    if isinstance(data_stream, MarketData):
+        if time_interval is not None and time_interval != data_stream.time_interval:
+            raise ValueError("time_interval {} conflicts with the market data's {}".format(time_interval, data_stream.time_interval))
+        return data_stream
+    key = (os.path.abspath(data_stream), time_interval, cache_dir)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = MarketData(data_stream, time_interval=time_interval, cache_dir=cache_dir)
+        return _shared[key]
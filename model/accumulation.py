@@ -0,0 +1,58 @@
+import threading
+import numpy as np
+import tensorflow as tf
+
+# Gradient accumulation: instead of an optimizer step per game, sum the gradients of several games and apply their
+# mean in one step (optionally clipped by global norm, as original/worker.py make_train_op does), so there are K times
+# fewer, less noisy, RMSProp updates for the same number of games.
+
+class GradientAccumulator:
+    # One per model, shared by every worker thread, so the graph has one set of accumulators and one optimizer step on
+    # them. Accumulators are non-trainable variables in no collection: outside the model's Saver and untouched by the
+    # global and local variable initializers, so only reset_op (run once, before the first game) initializes them
+    def __init__(self, model, accumulate_games=2, train_value=False, clip_norm=None):
+        self.accumulate_games = accumulate_games
+        self.games = 0 # accumulated since the last step, by every worker
+        self.lock = threading.Lock()
+        grads_and_vars = model.grads_and_vars if train_value else model.policy_grads_and_vars
+        grads_and_vars = [(grad, var) for grad, var in grads_and_vars if grad is not None]
+        with model.graph.as_default(), tf.variable_scope(None, default_name="gradient_accumulation"):
+            # resource variables, so a read is a snapshot that later assign_adds don't change
+            self.accumulators = [tf.get_variable("accumulator{}".format(n), initializer=tf.zeros(var.shape, dtype=var.dtype.base_dtype),
+                                                 trainable=False, collections=[], use_resource=True) for n, (grad, var) in enumerate(grads_and_vars)]
+            self.count = tf.get_variable("count", initializer=0., trainable=False, collections=[], use_resource=True)
+
+            self.accumulate_op = tf.group(*[accumulator.assign_add(grad) for accumulator, (grad, var) in zip(self.accumulators, grads_and_vars)]
+                                          + [self.count.assign_add(1.)])
+
+            # other workers keep accumulating while the step runs, so it takes away only what it read instead of zeroing
+            accumulated = [accumulator.read_value() for accumulator in self.accumulators]
+            count = self.count.read_value()
+            grads = [grad / tf.maximum(count, 1.) for grad in accumulated]
+            if clip_norm:
+                grads, self.global_norm = tf.clip_by_global_norm(grads, clip_norm)
+            else:
+                self.global_norm = tf.global_norm(grads)
+            apply_op = model.optimizer.apply_gradients(zip(grads, [var for grad, var in grads_and_vars]), global_step=tf.train.get_global_step())
+            with tf.control_dependencies([apply_op]):
+                self.apply_op = tf.group(*[accumulator.assign_sub(grad) for accumulator, grad in zip(self.accumulators, accumulated)]
+                                         + [self.count.assign_sub(count)])
+
+            self.reset_op = tf.group(*[accumulator.assign(tf.zeros(accumulator.shape, dtype=accumulator.dtype.base_dtype)) for accumulator in self.accumulators]
+                                     + [self.count.assign(0.)])
+
+    def add_games(self, games=1):
+        # after running accumulate_op; True if the caller should now run apply_op
+        with self.lock:
+            self.games += games
+            if self.games < self.accumulate_games:
+                return False
+            self.games = 0
+            return True
+
+def clip_by_global_norm(grads, clip_norm):
+    # numpy version of tf.clip_by_global_norm for {name: gradient}
+    norm = np.sqrt(sum(np.sum(np.square(grad)) for grad in grads.values()))
+    if norm <= clip_norm:
+        return grads
+    return {name: grad * clip_norm / norm for name, grad in grads.items()}
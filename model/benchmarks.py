@@ -0,0 +1,149 @@
+import time
+import itertools
+import threading
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from model.model import Model
+from model.worker import Worker, DATA
+from model.ga3c import Predictor, Trainer
+
+# Run from the repo root, e.g. python -m model.benchmarks
+
+def peak_memory_mb():
+    # peak RSS of this process; not available on Windows
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    except ImportError:
+        return float("nan")
+
+def benchmark_recurrent_build(seq_lengths=(100, 500, 1000, 2000, 5000), layer_size=64, runs=10):
+    # Unrolled rnn_decoder + per step heads vs. dynamic_rnn + one matmul per head
+    results = []
+    for seq_length in seq_lengths:
+        for dynamic in (False, True):
+            start = time.time()
+            m = Model(seq_length=seq_length, layer_size=layer_size, dynamic=dynamic)
+            build_time = time.time() - start
+            graph_def = m.graph.as_graph_def()
+
+            with m.graph.as_default():
+                init = tf.global_variables_initializer()
+            with tf.Session(graph=m.graph) as sess:
+                sess.run(init)
+                inputs = np.random.randn(m.batch_size, seq_length, m.inputs_per_time_step).astype(np.float32)
+                feed_dict = {m.inputs_ph: m.format_inputs(inputs),
+                             m.gru_state_ph: np.zeros([m.batch_size, m.layer_size], dtype=np.float32)}
+                fetches = [m.action_mu, m.action_sd, m.actions, m.value_op]
+                sess.run(fetches, feed_dict) # warm up
+                start = time.time()
+                for _ in range(runs):
+                    sess.run(fetches, feed_dict)
+                step_time = (time.time() - start) / runs
+
+            result = {"seq_length": seq_length, "dynamic": dynamic, "build_s": build_time, "graph_ops": len(graph_def.node),
+                      "graph_mb": graph_def.ByteSize() / 2**20, "peak_rss_mb": peak_memory_mb(), "step_ms": step_time * 1000}
+            results.append(result)
+            print("seq {seq_length:5d} {0:8s} build {build_s:7.2f}s, {graph_ops:6d} ops, graph {graph_mb:7.2f}MB, "
+                  "peak RSS {peak_rss_mb:7.0f}MB, step {step_ms:8.2f}ms".format("dynamic" if dynamic else "unrolled", **result))
+    return results
+
+def benchmark_update(seq_length=1000, layer_size=64, games=20):
+    # Session time per game: forward + separate policy/value runs vs. forward + one fused run vs. partial_run
+    m = Model(seq_length=seq_length, layer_size=layer_size)
+    with m.graph.as_default():
+        tf.train.create_global_step()
+        init = tf.global_variables_initializer()
+    inputs = m.format_inputs(np.random.randn(m.batch_size, seq_length, m.inputs_per_time_step).astype(np.float32))
+    state = np.zeros([m.batch_size, m.layer_size], dtype=np.float32)
+    targets = {m.policy_advantage: np.random.randn(m.batch_size, seq_length), m.discounted_rewards: np.random.randn(m.batch_size, seq_length)}
+    forward_feed = {m.inputs_ph: inputs, m.gru_state_ph: state}
+    fused = [m.train_op, m.summaries, m.policy_loss, m.value_loss]
+
+    def separate(sess):
+        actions = m.get_actions_states_values(sess, inputs, state)[2]
+        update_feed = dict(forward_feed, **targets)
+        update_feed[m.chosen_actions] = actions
+        sess.run(m.policy_train_op, update_feed)
+        sess.run(m.value_train_op, update_feed)
+
+    def one_run(sess):
+        actions = m.get_actions_states_values(sess, inputs, state)[2]
+        update_feed = dict(forward_feed, **targets)
+        update_feed[m.chosen_actions] = actions
+        sess.run(fused, update_feed)
+
+    def partial(sess):
+        handle = m.setup_rollout(sess, fused)
+        actions = m.get_actions_states_values(sess, inputs, state, handle=handle)[2]
+        update_feed = dict(targets)
+        update_feed[m.chosen_actions] = actions
+        sess.partial_run(handle, fused, update_feed)
+
+    results = {}
+    with tf.Session(graph=m.graph) as sess:
+        sess.run(init)
+        for name, play in (("separate", separate), ("fused", one_run), ("partial_run", partial)):
+            play(sess) # warm up
+            start = time.time()
+            for _ in range(games):
+                play(sess)
+            results[name] = (time.time() - start) / games * 1000
+            print("{:12s} {:8.2f}ms per game".format(name, results[name]))
+    return results
+
+def benchmark_ga3c(worker_counts=None, seconds=30, t_max=100, data=DATA):
+    # Games/sec with every worker's forward pass and update batched through one predictor and one trainer thread
+    if worker_counts is None:
+        worker_counts = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= multiprocessing.cpu_count()]
+    results = {}
+    for count in worker_counts:
+        m = Model(seq_length=t_max)
+        with m.graph.as_default():
+            init = [tf.global_variables_initializer(), tf.local_variables_initializer()]
+        with tf.Session(graph=m.graph) as sess:
+            sess.run(init)
+            predictor = Predictor(m, sess).start()
+            trainer = Trainer(m, sess)
+            trainer.start()
+            coord = tf.train.Coordinator()
+            workers = [Worker(global_model=m, T=itertools.count(1), T_max=None, t_max=t_max, states_to_prime=t_max, data=data,
+                              predictor=predictor, trainer=trainer) for _ in range(count)]
+            threads = [threading.Thread(target=lambda worker=worker: worker.run(sess, coord)) for worker in workers]
+            for thread in threads:
+                thread.start()
+            time.sleep(seconds)
+            coord.request_stop()
+            coord.join(threads)
+            predictor.stop()
+            trainer.stop()
+            results[count] = trainer.games_per_second()
+            print("{:3d} workers: {:8.1f} games/sec, {} updates, mean batch {:.1f}".format(
+                count, results[count], trainer.updates, trainer.games / max(trainer.updates, 1)))
+    return results
+
+def benchmark_a2c(batch_sizes=(1, 4, 16, 64), seconds=30, t_max=100, data=DATA):
+    # Steps/sec with one worker playing batch_size games in lock-step and updating once per batch (1 = the async loop)
+    results = {}
+    for batch_size in batch_sizes:
+        m = Model(seq_length=t_max)
+        with tf.Session(graph=m.graph) as sess:
+            coord = tf.train.Coordinator()
+            worker = Worker(global_model=m, T=itertools.count(1), T_max=None, t_max=t_max, states_to_prime=t_max, data=data, sync_games=batch_size)
+            thread = threading.Thread(target=lambda: worker.run(sess, coord))
+            thread.start()
+            time.sleep(seconds / 2) # let it warm up
+            start_games, start_time = worker.games_played, time.time()
+            time.sleep(seconds / 2)
+            games = worker.games_played - start_games
+            elapsed = time.time() - start_time
+            coord.request_stop()
+            coord.join([thread])
+        results[batch_size] = games * t_max / elapsed
+        print("{:3d} games per update: {:10.1f} steps/sec, {:6.2f} updates/sec".format(batch_size, results[batch_size], games / batch_size / elapsed))
+    return results
+
+if __name__ == "__main__":
+    benchmark_recurrent_build()
+    benchmark_update()
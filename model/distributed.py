@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import subprocess
+import threading
+import tensorflow as tf
+
+# Between-graph replicated A3C over a TF cluster. Parameter server (ps) tasks only hold the variables; every worker task
+# builds the whole Model with worker_device (variables on the ps tasks, everything else on itself) and runs its Worker
+# threads straight against the shared variables, so there is nothing to copy.
+# Worker task 0 is the chief: it restores or initializes the variables and owns the checkpoints; the other workers
+# wait until the variables are ready. The global step and the game count live on the ps tasks and count updates and games
+# from every task; the game count stands in for the per process itertools.count (GameCounter). When a worker task is
+# done it puts a token in a queue on every ps task; a ps task exits once every worker has.
+
+SAVE_CHECKPOINT_SECS = 600
+READY_POLL_SECS = 1
+PORT = 2222 # first port of a local cluster
+
+def make_cluster(ps_hosts, worker_hosts):
+    # comma separated host:port lists, as passed to train.py
+    return tf.train.ClusterSpec({"ps": ps_hosts.split(","), "worker": worker_hosts.split(",")})
+
+def local_hosts(number_of_tasks, port=PORT):
+    return ",".join("localhost:{}".format(port + n) for n in range(number_of_tasks))
+
+def worker_device(cluster, task_index):
+    # for Model(device=...)
+    return tf.train.replica_device_setter(worker_device="/job:worker/task:{}".format(task_index), cluster=cluster)
+
+def done_queues(cluster):
+    # One queue per ps task, shared by name between the tasks' graphs
+    queues = []
+    for ps in range(cluster.num_tasks("ps")):
+        with tf.device("/job:ps/task:{}".format(ps)):
+            queues.append(tf.FIFOQueue(cluster.num_tasks("worker"), tf.int32, shared_name="done_queue{}".format(ps)))
+    return queues
+
+def make_done_op(model, cluster):
+    # Run by a worker task when it has finished
+    with model.graph.as_default():
+        return tf.group(*[queue.enqueue(1) for queue in done_queues(cluster)])
+
+def run_ps(server, cluster, task_index):
+    # Serve the variables until every worker task has finished
+    graph = tf.Graph()
+    with graph.as_default():
+        dequeue = done_queues(cluster)[task_index].dequeue()
+    with tf.Session(server.target, graph=graph) as sess:
+        for _ in range(cluster.num_tasks("worker")):
+            sess.run(dequeue)
+    print("ps task {}: every worker is done, stopping".format(task_index))
+
+def restore_or_initialize(sess, model, checkpoint_dir):
+    # Chief only. Variables missing from the checkpoint (e.g. the global step and optimizer slots, when resuming from a
+    # single process run) are initialized, so the other workers only start once everything is set
+    variables = model.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+    restored = set()
+    latest_checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    with model.graph.as_default():
+        if latest_checkpoint:
+            print("Loading model checkpoint: {}".format(latest_checkpoint))
+            saved = {name for name, shape in tf.train.list_variables(latest_checkpoint)}
+            restored = {v.op.name for v in variables if v.op.name in saved}
+            tf.train.Saver([v for v in variables if v.op.name in restored]).restore(sess, latest_checkpoint)
+        sess.run(tf.variables_initializer([v for v in variables if v.op.name not in restored]))
+
+def wait_until_ready(sess, model):
+    with model.graph.as_default():
+        uninitialized = tf.report_uninitialized_variables()
+    while len(sess.run(uninitialized)):
+        print("Waiting for the chief to initialize the variables")
+        time.sleep(READY_POLL_SECS)
+
+def create_session(server, model, is_chief, checkpoint_dir):
+    sess = tf.Session(server.target, graph=model.graph)
+    if is_chief:
+        restore_or_initialize(sess, model, checkpoint_dir)
+    else:
+        wait_until_ready(sess, model)
+    return sess
+
+class GameCounter:
+    # The cluster wide game count for Worker.run: next() and str() behave like the itertools.count they replace.
+    # Counts games, not the global step, which with gradient accumulation is one per several games
+    def __init__(self, sess, model):
+        self.sess = sess
+        self.model = model
+        with model.graph.as_default():
+            self.increment = model.games.assign_add(1)
+
+    def __next__(self):
+        return int(self.sess.run(self.increment))
+
+    def value(self):
+        return int(self.sess.run(self.model.games))
+
+    def __str__(self):
+        return "count({})".format(self.value() + 1)
+
+class CheckpointSaver(threading.Thread):
+    # Chief only: saves every save_secs, and once more on stop()
+    def __init__(self, sess, model, checkpoint_dir, save_secs=SAVE_CHECKPOINT_SECS):
+        super().__init__(daemon=True)
+        self.sess = sess
+        self.model = model
+        self.checkpoint_path = os.path.join(checkpoint_dir, "model")
+        self.save_secs = save_secs
+        self.stop_event = threading.Event()
+
+    def save(self):
+        self.model.saver.save(self.sess, self.checkpoint_path, global_step=self.model.global_step)
+
+    def run(self):
+        while not self.stop_event.wait(self.save_secs):
+            self.save()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.save()
+
+def launch_local_cluster(script, number_of_workers, number_of_ps=1, port=PORT, args=()):
+    # Every task of a cluster as a local process on localhost ports, to try the distributed mode on one machine
+    ps_hosts = local_hosts(number_of_ps, port)
+    worker_hosts = local_hosts(number_of_workers, port + number_of_ps)
+    processes = []
+    for job_name, number_of_tasks in (("ps", number_of_ps), ("worker", number_of_workers)):
+        for task_index in range(number_of_tasks):
+            processes.append(subprocess.Popen([sys.executable, script, "--job_name={}".format(job_name), "--task_index={}".format(task_index),
+                                               "--ps_hosts={}".format(ps_hosts), "--worker_hosts={}".format(worker_hosts)] + list(args)))
+    return [process.wait() for process in processes]
@@ -0,0 +1,110 @@
+import time
+import queue
+import threading
+import collections
+import numpy as np
+import tensorflow as tf
+from model.inference import InferenceService, collect_batch
+
+# GA3C style training: worker threads only play games.
+# Their forward passes go through one Predictor thread and their experience through one Trainer thread, each of which
+# batches whatever has queued up into a single session call, instead of every worker calling sess.run on its own.
+# Both share one session, so the predictor always acts with the trainer's latest parameters.
+
+TRAIN_BATCH_SIZE = 8
+TRAIN_MAX_WAIT_MS = 10
+
+class Predictor(InferenceService):
+    # Batched forward passes for the workers; also returns the sampled actions
+    def __init__(self, model, sess, **kwargs):
+        super().__init__(model, sess=sess, **kwargs)
+        self.fetches["actions"] = model.actions
+
+class Experience:
+    # One finished game, [seq x ...] arrays without the batch dimension
+    def __init__(self, inputs, gru_state, chosen_actions, policy_advantage, discounted_rewards):
+        self.inputs = inputs
+        self.gru_state = gru_state
+        self.chosen_actions = chosen_actions
+        self.policy_advantage = policy_advantage
+        self.discounted_rewards = discounted_rewards
+        self.shape = inputs.shape
+        self.arrival = time.time()
+
+class Trainer(threading.Thread):
+    def __init__(self, model, sess, train_value=False, batch_size=TRAIN_BATCH_SIZE, max_wait_ms=TRAIN_MAX_WAIT_MS, summary_writer=None,
+                 state_cache=None):
+        super().__init__(daemon=True)
+        self.model = model
+        self.sess = sess
+        self.summary_writer = summary_writer
+        self.state_cache = state_cache # told about every update, so cached GRU states age
+        self.fixed_batch = not (model.naive or model.dynamic) # unrolled GRU only takes batch_size games
+        self.batch_size = model.batch_size if self.fixed_batch else batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.train_value = train_value
+        if self.train_value:
+            self.update_fetches = [model.train_op, model.summaries, model.policy_loss, model.value_loss]
+        else:
+            self.update_fetches = [model.policy_train_op, model.policy_loss_summary, model.policy_loss]
+
+        self.experience = queue.Queue()
+        self.deferred = collections.deque()
+        self.stop_event = threading.Event()
+
+        self.updates = 0
+        self.games = 0
+        self.start_time = None
+        self.policy_loss = "N/A"
+        self.value_loss = "N/A"
+
+    def submit(self, experience):
+        self.experience.put(experience)
+
+    def stop(self):
+        self.stop_event.set()
+        self.experience.put(None)
+        self.join()
+
+    def run(self):
+        self.start_time = time.time()
+        while not self.stop_event.is_set():
+            batch = collect_batch(self.experience, self.deferred, self.batch_size, self.max_wait)
+            if self.fixed_batch and 0 < len(batch) < self.batch_size:
+                # the unrolled GRU only takes exactly batch_size games, and padding with copies would give those games
+                # extra weight; put them back and wait for another game
+                self.deferred.extendleft(reversed(batch))
+                item = self.experience.get()
+                if item is not None:
+                    self.deferred.append(item)
+                continue
+            if batch:
+                self.train(batch)
+
+    def stack(self, batch, name):
+        return np.stack([getattr(experience, name) for experience in batch])
+
+    def train(self, batch):
+        m = self.model
+        feed_dict = {m.inputs_ph: m.format_inputs(self.stack(batch, "inputs")),
+                     m.chosen_actions: self.stack(batch, "chosen_actions"),
+                     m.policy_advantage: self.stack(batch, "policy_advantage"),
+                     m.discounted_rewards: self.stack(batch, "discounted_rewards")}
+        if not m.naive:
+            feed_dict[m.gru_state_ph] = self.stack(batch, "gru_state")
+        results = self.sess.run(self.update_fetches, feed_dict=feed_dict)
+
+        self.updates += 1
+        if self.state_cache is not None:
+            self.state_cache.bump_version()
+        self.games += len(batch)
+        self.policy_loss = results[2]
+        if self.train_value:
+            self.value_loss = results[3]
+        if self.summary_writer is not None:
+            self.summary_writer.add_summary(results[1], self.updates)
+
+    def games_per_second(self):
+        if self.start_time is None:
+            return 0
+        return self.games / (time.time() - self.start_time)
@@ -0,0 +1,195 @@
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from model.returns import vtrace
+from model.parameter_store import CONTEXT, make_copy_params_op, copy_params, start_processes
+
+# IMPALA style training (Espeholt et al. 2018): actor processes only play games, with a snapshot of the parameters that
+# they refresh every sync_every games, and send each game -- with the behaviour policy (action mu/sd) that played it --
+# to one learner. The learner trains on large batches of games and publishes its parameters to a ParameterStore after
+# every update. The actors' snapshots lag behind the learner's parameters, so the policy advantages and value targets
+# fed to the Model's losses are V-trace corrected (model.returns.vtrace) instead of plain discounted returns.
+
+LEARNER_BATCH_SIZE = 32
+SYNC_EVERY = 1 # games an actor plays between parameter refreshes
+QUEUE_SIZE = 256 # games in flight; actors block on a full queue, which bounds how stale their games get
+CLIP_RHO = 1.
+CLIP_PG_RHO = 1.
+REPORT_EVERY = 100 # learner updates between stats
+
+class Trajectory:
+    # One game played by an actor, [seq x ...] arrays without the batch dimension
+    def __init__(self, inputs, gru_state, chosen_actions, action_mu, action_sd, rewards, version):
+        self.inputs = inputs
+        self.gru_state = gru_state
+        self.chosen_actions = chosen_actions
+        self.action_mu = action_mu
+        self.action_sd = action_sd
+        self.rewards = rewards
+        self.version = version # parameter store version the actor played with
+
+def normal_log_prob(x, mu, sd):
+    # log density of the Model's action distribution, Normal(action_mu, action_sd)
+    return -.5 * np.square((x - mu) / sd) - np.log(sd) - .5 * np.log(2 * np.pi)
+
+def add_vtrace_targets(sess, model, feed_dict, chosen_actions, behaviour_mu, behaviour_sd, rewards, discount,
+                       clip_rho=CLIP_RHO, clip_pg_rho=CLIP_PG_RHO):
+    # Games played by an older (behaviour) policy: run the current policy and values on feed_dict's inputs and add the
+    # V-trace corrected update feeds to it. Returns the log importance weights, [batch x t]
+    action_mu, action_sd, values = sess.run([model.action_mu, model.action_sd, model.value_op], feed_dict=feed_dict)
+    behaviour_log_probs = normal_log_prob(chosen_actions, behaviour_mu, behaviour_sd)
+    target_log_probs = normal_log_prob(chosen_actions, action_mu, action_sd)
+    value_targets, policy_advantage = vtrace(behaviour_log_probs, target_log_probs, rewards, values, discount,
+                                             clip_rho=clip_rho, clip_pg_rho=clip_pg_rho)
+    feed_dict.update({model.chosen_actions: chosen_actions, model.policy_advantage: policy_advantage, model.discounted_rewards: value_targets})
+    return (target_log_probs - behaviour_log_probs).sum(axis=2)
+
+def run_actor_process(actor_id, store, trajectories, games, seconds, model_params, actor_params, sync_every=SYNC_EVERY):
+    # Entry point of one actor process: play games with a local snapshot of the store's parameters and queue them
+    from model.model import Model
+    from model.worker import Worker
+
+    np.random.seed((os.getpid() * 7919 + actor_id) % 2**32)
+    model = Model(**model_params)
+    worker = Worker(global_model=model, T=None, T_max=None, **actor_params)
+    copy_params_op = make_copy_params_op(model, store)
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+    with tf.Session(graph=model.graph, config=config) as sess:
+        with model.graph.as_default():
+            sess.run(tf.global_variables_initializer())
+        version = None
+        while True:
+            start = time.time()
+            if games[actor_id] % sync_every == 0 and store.version != version:
+                version = store.version # read first: the copied parameters are at least this new
+                copy_params(sess, model, store, copy_params_op)
+            worker.play_game2(sess, starting_state=np.random.randint(*worker.exchange.state_range))
+            played = [Trajectory(worker.game_inputs[n], worker.initial_gru_state[n], worker.chosen_actions[n], worker.action_mu[n],
+                                 worker.action_sd[n], worker.rewards[n], version) for n in range(len(worker.game_inputs))]
+            # time spent waiting on a full queue is the learner's bottleneck, not the actor's
+            seconds[actor_id] += time.time() - start
+            for trajectory in played:
+                trajectories.put(trajectory)
+            games[actor_id] += len(played)
+
+class ActorPool:
+    # The actor processes and the queue of games they fill
+    def __init__(self, number_of_actors, store, model_params, actor_params, sync_every=SYNC_EVERY, queue_size=QUEUE_SIZE):
+        self.trajectories = CONTEXT.Queue(maxsize=queue_size)
+        self.games = CONTEXT.RawArray("q", number_of_actors) # per actor, written only by that actor
+        self.seconds = CONTEXT.RawArray("d", number_of_actors) # per actor time spent playing
+        self.processes = start_processes(run_actor_process, [(actor_id, store, self.trajectories, self.games, self.seconds, model_params,
+                                                              actor_params, sync_every) for actor_id in range(number_of_actors)])
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+
+    def get_stats(self):
+        games = np.array(self.games[:])
+        seconds = np.array(self.seconds[:])
+        # each actor's own games/sec, ignoring time it was blocked by the learner
+        rates = np.where(seconds > 0, games / np.maximum(seconds, 1e-9), 0.)
+        return {"actors": len(games), "games": int(games.sum()), "games_per_second": rates.sum(),
+                "games_per_second_per_actor": rates.mean()}
+
+class Learner:
+    def __init__(self, model, sess, store, batch_size=LEARNER_BATCH_SIZE, train_value=True, summary_writer=None,
+                 discount=None, clip_rho=CLIP_RHO, clip_pg_rho=CLIP_PG_RHO):
+        if not (model.naive or model.dynamic) and batch_size != model.batch_size:
+            raise ValueError("The unrolled GRU model trains on exactly batch_size ({}) games".format(model.batch_size))
+        self.model = model
+        self.sess = sess
+        self.store = store
+        self.batch_size = batch_size
+        self.summary_writer = summary_writer
+        if discount is None:
+            from model.worker import EXPERIMENT
+            discount = 0 if EXPERIMENT else model.discount # as Worker.play_game2 sets it
+        self.discount = discount
+        self.clip_rho = clip_rho
+        self.clip_pg_rho = clip_pg_rho
+
+        self.train_value = train_value
+        if self.train_value:
+            self.update_fetches = [model.train_op, model.summaries, model.policy_loss, model.value_loss]
+        else:
+            self.update_fetches = [model.policy_train_op, model.policy_loss_summary, model.policy_loss]
+        variables = {v.name: v for v in model.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)}
+        self.variables = [variables[name] for name in store.names]
+
+        self.updates = 0
+        self.games = 0
+        self.wait_seconds = 0. # waiting on the actors
+        self.train_seconds = 0.
+        self.lag = 0 # total parameter versions the games were behind by
+        self.clipped = 0 # steps whose importance weight was clipped
+        self.steps = 0
+        self.policy_loss = "N/A"
+        self.value_loss = "N/A"
+
+    def publish(self):
+        # call once before starting the actors, so they don't play with uninitialized parameters
+        self.store.publish(dict(zip(self.store.names, self.sess.run(self.variables))))
+
+    def get_batch(self, trajectories):
+        start = time.time()
+        batch = [trajectories.get()]
+        while len(batch) < self.batch_size:
+            batch.append(trajectories.get())
+        self.wait_seconds += time.time() - start
+        return batch
+
+    def train(self, batch):
+        start = time.time()
+        m = self.model
+        stack = lambda name: np.stack([getattr(trajectory, name) for trajectory in batch])
+        feed_dict = {m.inputs_ph: m.format_inputs(stack("inputs"))}
+        if not m.naive:
+            feed_dict[m.gru_state_ph] = stack("gru_state")
+        log_rhos = add_vtrace_targets(self.sess, m, feed_dict, stack("chosen_actions"), stack("action_mu"), stack("action_sd"),
+                                      stack("rewards"), self.discount, self.clip_rho, self.clip_pg_rho)
+        results = self.sess.run(self.update_fetches, feed_dict=feed_dict)
+        self.publish()
+
+        version = self.store.version
+        self.lag += sum(version - 1 - trajectory.version for trajectory in batch)
+        self.clipped += int((log_rhos > np.log(self.clip_rho)).sum())
+        self.steps += log_rhos.size
+        self.updates += 1
+        self.games += len(batch)
+        self.policy_loss = results[2]
+        if self.train_value:
+            self.value_loss = results[3]
+        if self.summary_writer is not None:
+            self.summary_writer.add_summary(results[1], self.updates)
+        self.train_seconds += time.time() - start
+
+    def run(self, actors, max_games, report_every=REPORT_EVERY):
+        # Train on the ActorPool's games until max_games of them have been consumed
+        while self.games < max_games:
+            self.train(self.get_batch(actors.trajectories))
+            if self.updates % report_every == 0:
+                self.print_stats(actors)
+
+    def get_stats(self):
+        return {"updates": self.updates, "games": self.games,
+                # games the learner could consume per second if it never waited on the actors
+                "games_per_second": self.games / self.train_seconds if self.train_seconds else 0.,
+                "updates_per_second": self.updates / self.train_seconds if self.train_seconds else 0.,
+                "waiting": self.wait_seconds / (self.wait_seconds + self.train_seconds) if self.train_seconds else 0.,
+                "lag": self.lag / self.games if self.games else 0., "clipped": self.clipped / self.steps if self.steps else 0.}
+
+    def print_stats(self, actors=None):
+        print("Learner: {updates} updates, {games} games, {games_per_second:.1f} games/sec ({updates_per_second:.2f} updates/sec), "
+              "{waiting:.0%} of the time waiting on actors; policy lag {lag:.1f} versions, {clipped:.1%} of steps clipped".format(**self.get_stats()))
+        print("Policy loss {}, value loss {}".format(self.policy_loss, self.value_loss))
+        if actors is not None:
+            try:
+                queued = actors.trajectories.qsize()
+            except NotImplementedError: # macOS
+                queued = "?"
+            print("Actors: {actors} actors, {games} games, {games_per_second:.1f} games/sec ({games_per_second_per_actor:.1f} each), "
+                  "{queued} games queued".format(queued=queued, **actors.get_stats()))
@@ -0,0 +1,210 @@
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import Future
+import numpy as np
+import tensorflow as tf
+
+# Policy/value queries against one long lived session.
+# Callers on any thread submit single games ([seq x inputs per step] plus an optional GRU state); a batching thread
+# stacks whatever has arrived within max_wait_ms (up to max_batch_size games of the same shape) into one forward pass.
+#
+#   service = InferenceService(m, checkpoint_dir=CHECKPOINT_DIR)
+#   service.start()
+#   result = service.query(inputs, gru_state)  # {"action_mu", "action_sd", "value", "state" (GRU only)}
+#   print(service.get_stats())
+#   service.stop()
+
+MAX_BATCH_SIZE = 32
+MAX_WAIT_MS = 2
+LATENCY_WINDOW = 100000 # keep this many of the most recent latencies for the percentiles
+
+class _Request:
+    def __init__(self, inputs, gru_state):
+        self.inputs = inputs
+        self.gru_state = gru_state
+        self.shape = inputs.shape
+        self.future = Future()
+        self.arrival = time.time()
+
+def collect_batch(requests, deferred, max_batch_size, max_wait):
+    # Wait for one item, then take everything of the same shape that arrives before its deadline
+    # Items need .shape and .arrival; ones of another shape are left in deferred for a later batch
+    if deferred:
+        first = deferred.popleft()
+    else:
+        try:
+            first = requests.get(timeout=.1)
+        except queue.Empty:
+            return []
+        if first is None:
+            return []
+    batch = [first]
+
+    # older deferred items of the same shape go first
+    for item in list(deferred):
+        if len(batch) == max_batch_size:
+            break
+        if item.shape == first.shape:
+            deferred.remove(item)
+            batch.append(item)
+
+    deadline = first.arrival + max_wait
+    while len(batch) < max_batch_size:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            break
+        try:
+            item = requests.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if item is None:
+            break
+        if item.shape == first.shape:
+            batch.append(item)
+        else:
+            deferred.append(item)
+    return batch
+
+class InferenceService:
+    def __init__(self, model, checkpoint_dir=None, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, reload_secs=None, sess=None):
+        self.model = model
+        self.checkpoint_dir = checkpoint_dir
+        self.reload_secs = reload_secs # look for a newer checkpoint this often, None to only load at start
+        self.max_wait = max_wait_ms / 1000.
+        self.fixed_batch = not (model.naive or model.dynamic) # unrolled GRU only takes batch_size games
+        self.max_batch_size = model.batch_size if self.fixed_batch else max_batch_size
+
+        # sess - share an existing session (and so its variables), e.g. with a trainer; otherwise one is made and initialized
+        self.own_session = sess is None
+        self.sess = tf.Session(graph=model.graph) if sess is None else sess
+        self.session_lock = threading.Lock()
+        self.checkpoint = None
+        self.last_reload = 0
+
+        self.requests = queue.Queue()
+        self.deferred = collections.deque() # requests that didn't match the shape of the batch they arrived during
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = collections.Counter()
+        self.stats_lock = threading.Lock()
+
+        # what each request gets back, indexed by its row in the batch
+        self.fetches = {"action_mu": model.action_mu, "action_sd": model.action_sd, "value": model.value_op}
+        if not self.model.naive:
+            self.fetches["state"] = model.network_output[1][0] # final GRU state, what gets fed back as gru_state
+
+        if self.own_session:
+            with model.graph.as_default():
+                self.init_op = tf.global_variables_initializer()
+            self.sess.run(self.init_op)
+        self.load_latest()
+
+    def load_latest(self):
+        # Restore the newest checkpoint in checkpoint_dir, if there is one we haven't loaded yet
+        self.last_reload = time.time()
+        if self.checkpoint_dir is None:
+            return False
+        latest_checkpoint = tf.train.latest_checkpoint(self.checkpoint_dir)
+        if latest_checkpoint is None or latest_checkpoint == self.checkpoint:
+            return False
+        with self.session_lock:
+            self.model.saver.restore(self.sess, latest_checkpoint)
+        self.checkpoint = latest_checkpoint
+        print("Inference loaded model checkpoint: {}".format(latest_checkpoint))
+        return True
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.requests.put(None) # wake the batching thread
+        if self.thread is not None:
+            self.thread.join()
+        if self.own_session:
+            self.sess.close()
+
+    def submit(self, inputs, gru_state=None):
+        # inputs = [seq x inputs per step] for one game; returns a Future
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if gru_state is None:
+            gru_state = np.zeros(self.model.layer_size, dtype=np.float32)
+        request = _Request(inputs, np.asarray(gru_state, dtype=np.float32).reshape(self.model.layer_size))
+        self.requests.put(request)
+        return request.future
+
+    def query(self, inputs, gru_state=None, timeout=None):
+        return self.submit(inputs, gru_state).result(timeout)
+
+    def get_value(self, inputs, gru_state=None):
+        return self.query(inputs, gru_state)["value"]
+
+    def get_policy(self, inputs, gru_state=None):
+        result = self.query(inputs, gru_state)
+        return result["action_mu"], result["action_sd"]
+
+    def serve(self):
+        while not self.stop_event.is_set():
+            if self.reload_secs is not None and time.time() - self.last_reload > self.reload_secs:
+                self.load_latest()
+            batch = collect_batch(self.requests, self.deferred, self.max_batch_size, self.max_wait)
+            if batch:
+                self.run_batch(batch)
+
+        # don't leave anyone waiting
+        for request in list(self.deferred) + list(self.requests.queue):
+            if request is not None:
+                request.future.cancel()
+
+    def run_batch(self, batch):
+        inputs = np.stack([request.inputs for request in batch])
+        states = np.stack([request.gru_state for request in batch])
+        if self.fixed_batch and len(batch) < self.model.batch_size:
+            # pad up to the placeholder's batch size; the extra rows are dropped below
+            inputs = np.concatenate([inputs, np.zeros((self.model.batch_size - len(batch),) + inputs.shape[1:], dtype=np.float32)])
+            states = np.concatenate([states, np.zeros((self.model.batch_size - len(batch), self.model.layer_size), dtype=np.float32)])
+
+        feed_dict = {self.model.inputs_ph: self.model.format_inputs(inputs)}
+        if not self.model.naive:
+            feed_dict[self.model.gru_state_ph] = states
+        try:
+            with self.session_lock:
+                results = self.sess.run(self.fetches, feed_dict=feed_dict)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        done = time.time()
+        for n, request in enumerate(batch):
+            request.future.set_result({name: value[n] for name, value in results.items()})
+
+        with self.stats_lock:
+            self.batch_sizes[len(batch)] += 1
+            self.latencies.extend(done - request.arrival for request in batch)
+
+    def get_stats(self):
+        # p50/p99 latency in ms over the most recent requests, and how many forward passes ran at each batch size
+        with self.stats_lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+        stats = {"requests": len(latencies), "batches": sum(batch_sizes.values()), "batch_sizes": batch_sizes}
+        if len(latencies):
+            stats["p50_ms"], stats["p99_ms"] = np.percentile(latencies, [50, 99])
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        if not stats["requests"]:
+            print("No requests served")
+            return
+        print("{requests} requests in {batches} batches, p50 {p50_ms:.2f}ms, p99 {p99_ms:.2f}ms".format(**stats))
+        for size, count in stats["batch_sizes"].items():
+            print("  batch {:4d}: {}".format(size, count))
@@ -11,6 +11,7 @@ sys.path.append("..")
 LR = .00025
 #LR = .001
 ENTROPY_WT = 1e-2
+VALUE_WT = .5 # weight of the value loss in the combined actor-critic loss
 #MAIN_INITIALIZER = tfcl.variance_scaling_initializer()
 MAIN_INITIALIZER = tf.random_normal_initializer(0., .01)
 DISCOUNT = .7
@@ -49,8 +50,8 @@ def fc_list(inputs, num_nodes, name='0', activation=tf.nn.relu, scope = ""):
 
 # This just converts down multiple batch samples -- e.g. a 5 batch, 1000 sequence game = [5000 batches X layer input size]
 def fc_list2(inputs, num_nodes, batch_size, name='1', activation=tf.nn.relu):
-    # batch_size = self.batch_size * self.seq_length
-    temp_inputs = tf.reshape(inputs, [batch_size, -1])
+    # batch_size = self.batch_size * self.seq_length, or -1 if that isn't fixed
+    temp_inputs = tf.reshape(inputs, [batch_size, int(inputs.shape[-1])])
     output_list = tf.contrib.layers.fully_connected(temp_inputs, num_nodes, weights_initializer=MAIN_INITIALIZER, scope = name, activation_fn = activation)
     return output_list
 
@@ -64,8 +65,10 @@ def get_gru(num_layers, state_dim, reuse=False):
 
 class Model:
     def __init__(self, batch_size=1, inputs_per_time_step=2, seq_length=1000, num_layers=1, layer_size=64, trainable = True,
-                 discount = DISCOUNT, naive=False, fixed_sd = 0):
+                 discount = DISCOUNT, naive=False, fixed_sd = 0, dynamic = True, device=None):
         self.seq_length = seq_length
+        self.device = device # e.g. a replica_device_setter, to keep the variables on parameter servers (model.distributed)
+        self.dynamic = dynamic # GRU as a while loop (dynamic_rnn) instead of unrolling seq_length steps
         self.batch_size = batch_size
         self.fixed_sd = fixed_sd
         self.inputs_per_time_step = inputs_per_time_step
@@ -84,41 +87,71 @@ class Model:
         # learning_rate = 0.00025
         self.optimizer = tf.train.RMSPropOptimizer(learning_rate = LR, decay=0.99, momentum=0.0, epsilon=1e-6)
         self.saver = None
+        self.global_step = None
+        self.games = None
         self.trainable = trainable
         self.graph = tf.Graph()
         self.discount = discount
         self.entropy_weight = ENTROPY_WT
         self.naive = naive
         self.network_output = None
+        self.value_loss_weight = VALUE_WT
         self.build_network()
+        if self.trainable:
+            self.build_training_ops()
 
 
     def get_params(self):
         return {"input_size":self.input_size, "layer_size":self.layer_size, "trainable": self.trainable, "discount":self.discount}
 
+    # Inputs for the model as a [batch x seq x inputs per step] array, in whatever shape inputs_ph takes
+    def format_inputs(self, inputs):
+        if self.naive or self.dynamic:
+            return inputs
+        return np.reshape(inputs, [len(inputs), -1]) # unrolled GRU takes them flattened
+
     def build_input_layer(self, name = "input_fc"):
-        temp_inputs = tf.reshape(self.inputs_ph, [self.batch_size * self.seq_length, -1])
+        temp_inputs = tf.reshape(self.inputs_ph, [-1, self.input_size])
         output_list = tf.contrib.layers.fully_connected(temp_inputs, self.layer_size,
                                                         weights_initializer=MAIN_INITIALIZER,
                                                         biases_initializer=tf.zeros_initializer(),
                                                         scope=name, activation_fn=tf.nn.relu6)  # this is just a 256 node network instead of GRU
         # output_list = [batch * seq X 256]
-        output_list = tf.reshape(output_list, [self.batch_size, self.seq_length, -1])
+        output_list = tf.reshape(output_list, [self.batch_size_op, self.seq_length_op, self.layer_size])
         return output_list
 
     def build_network(self):
-        with self.graph.as_default():
+        with self.graph.as_default(), tf.device(self.device):
+            if self.device is not None:
+                # distributed: updates and games from every task are counted on the parameter servers (and saved with the model)
+                self.global_step = tf.train.get_or_create_global_step()
+                self.games = tf.Variable(0, dtype=tf.int64, trainable=False, name="games")
+
+            # Batch and time dimensions are left open, so one graph serves training batches, single steps and long sweeps
+            # Only the unrolled GRU needs them fixed at batch_size x seq_length
+            variable_shape = self.naive or self.dynamic
+            batch_dim = None if variable_shape else self.batch_size
+            seq_dim = None if variable_shape else self.seq_length
+
             if self.naive:
-                self.inputs_ph = tf.placeholder(tf.float32, shape=[self.batch_size, self.seq_length, self.input_size], name='inputs')
+                self.inputs_ph = tf.placeholder(tf.float32, shape=[batch_dim, seq_dim, self.input_size], name='inputs')
+            elif self.dynamic:
+                self.inputs_ph = tf.placeholder(tf.float32, shape=[batch_dim, seq_dim, self.inputs_per_time_step], name='inputs')
             else:
                 self.inputs_ph = tf.placeholder(tf.float32, shape=[self.batch_size, self.input_size], name='inputs')
-            self.targets_ph = tf.placeholder(tf.float32, shape=[self.batch_size, self.input_size], name='targets')
-            self.gru_state_ph = tf.placeholder(tf.float32, shape=[self.batch_size, self.layer_size], name='gru_state')
-            self.policy_advantage = tf.placeholder(tf.float32, shape=[self.batch_size, self.seq_length], name='advantages')
-            self.chosen_actions = tf.placeholder(tf.float32, shape=[self.batch_size, self.seq_length, self.number_of_actions], name='chosen_actions')
-            self.discounted_rewards = tf.placeholder(tf.float32, shape=[self.batch_size, self.seq_length], name='discounted_rewards')
-
-            inputs = tf.split(self.inputs_ph, self.seq_length, axis=1)
+            self.targets_ph = tf.placeholder(tf.float32, shape=[batch_dim, None], name='targets')
+            self.gru_state_ph = tf.placeholder(tf.float32, shape=[batch_dim, self.layer_size], name='gru_state')
+            self.policy_advantage = tf.placeholder(tf.float32, shape=[batch_dim, seq_dim], name='advantages')
+            self.chosen_actions = tf.placeholder(tf.float32, shape=[batch_dim, seq_dim, self.number_of_actions], name='chosen_actions')
+            self.discounted_rewards = tf.placeholder(tf.float32, shape=[batch_dim, seq_dim], name='discounted_rewards')
+
+            # Actual batch size and sequence length of what was fed
+            if variable_shape:
+                self.batch_size_op = tf.shape(self.inputs_ph)[0]
+                self.seq_length_op = tf.shape(self.inputs_ph)[1]
+            else:
+                self.batch_size_op = self.batch_size
+                self.seq_length_op = self.seq_length
 
             if self.naive:
                 #self.inputs_ph 1 X SEQ X (eg. 10 input prices/sides)
@@ -137,11 +170,11 @@ class Model:
 
 
                 #inputs, num_nodes, batch_size
-                actions_raw = fc_list2(inputs = self.output_list_policy, num_nodes = self.number_of_actions * 2, batch_size = self.batch_size * self.seq_length, name='action_fc', activation=None)
+                actions_raw = fc_list2(inputs = self.output_list_policy, num_nodes = self.number_of_actions * 2, batch_size = -1, name='action_fc', activation=None)
                 self.value_op1 = fc_list2(inputs=self.output_list_value, num_nodes=1,
-                                       batch_size=self.batch_size * self.seq_length, name='value_fc',
+                                       batch_size=-1, name='value_fc',
                                        activation=None) # this is (SEQ LEN * BATCH) X 1
-                self.value_op = tf.reshape(self.value_op1,[self.batch_size, self.seq_length]) # model expects SEQ * 1
+                self.value_op = tf.reshape(self.value_op1,[self.batch_size_op, self.seq_length_op]) # model expects SEQ * 1
                 #print(self.value_op.shape)
             else:
                 with tf.name_scope("gru_shared_network") as scope:
@@ -154,30 +187,64 @@ class Model:
                         # network_output is a tuple of (output_list, final_state)
                         # note that (output_list) is really just the GRU state at each time step
                         # (e.g. the final element in output_list is equal to final_state)
-                        self.network_output = seq2seq.rnn_decoder(inputs, initial_state, self.multi_cell)
+                        if self.dynamic:
+                            # one while loop instead of seq_length copies of the cell; same variable names as rnn_decoder
+                            # output_list = [batch x seq x layer_size]
+                            self.network_output = tf.nn.dynamic_rnn(self.multi_cell, self.inputs_ph, initial_state=initial_state, scope='rnn_decoder')
+                        else:
+                            # output_list = seq_length tensors of [batch x layer_size]
+                            inputs = tf.split(self.inputs_ph, self.seq_length, axis=1)
+                            self.network_output = seq2seq.rnn_decoder(inputs, initial_state, self.multi_cell)
                         self.output_list = self.network_output[0]
                         final_state = self.network_output[1]
 
-
-                # Actions distribution: [batch_size x seq_length x number_of_actions x 2]
-                # i.e. one mu and one standard deviation for each action at each step of each sequence
-                actions_raw = fc_list(self.output_list, self.number_of_actions * 2, name='action', activation=None, scope="actions_fc")
-
-                # Value: [batch_size x seq_length]
-                # i.e. one value per step in the sequence, for all sequences
-                self.value_op = fc_list(self.output_list, 1, name='value', activation=None, scope="value_fc")
-
-            self.actions_op = tf.reshape(actions_raw, [self.batch_size, self.seq_length, self.number_of_actions, 2])
+                if self.dynamic:
+                    # Both heads are one matmul over every step of every sequence (same variables as fc_list)
+                    flat_outputs = tf.reshape(self.output_list, [-1, self.layer_size])
+                    with tf.name_scope("actions_fc"):
+                        actions_raw = fc(flat_outputs, self.number_of_actions * 2, name='action', activation=None)
+                    with tf.name_scope("value_fc"):
+                        self.value_op = tf.reshape(fc(flat_outputs, 1, name='value', activation=None), [self.batch_size_op, self.seq_length_op])
+                else:
+                    # Actions distribution: [batch_size x seq_length x number_of_actions x 2]
+                    # i.e. one mu and one standard deviation for each action at each step of each sequence
+                    actions_raw = fc_list(self.output_list, self.number_of_actions * 2, name='action', activation=None, scope="actions_fc")
+
+                    # Value: [batch_size x seq_length]
+                    # i.e. one value per step in the sequence, for all sequences
+                    self.value_op = fc_list(self.output_list, 1, name='value', activation=None, scope="value_fc")
+
+            self.actions_op = tf.reshape(actions_raw, [self.batch_size_op, self.seq_length_op, self.number_of_actions, 2])
             self.action_mu = tf.nn.sigmoid(self.actions_op[:, :, :, 0]) # something from -.5 to .5
             self.action_sd = tf.nn.softplus(self.actions_op[:, :, :, 1] + 1e-4) # this should not be 0; it doesn't need to be bigger than 1
 
             self.action_dist = tf.contrib.distributions.Normal(self.action_mu, self.action_sd)
-            self.actions = tf.clip_by_value(tf.squeeze(self.action_dist.sample([self.batch_size]), axis=0), A_BOUND[0], A_BOUND[1])  # sample a action from distribution
+            self.actions = tf.clip_by_value(self.action_dist.sample(), A_BOUND[0], A_BOUND[1])  # sample a action from distribution, [batch, t, # of actions]
 
             #self.action_sd = tf.minimum(tf.nn.softplus(self.actions_op[:, :, :, 1]) + 1e-3,1) # this should not be 0; it doesn't need to be bigger than 1
 
+            if not self.naive:
+                self.build_step_network()
+
             self.saver = tf.train.Saver()
 
+    def build_step_network(self):
+        # One GRU tick on the same weights: [batch x inputs per step] + carried state -> actions, value, next state
+        # The state carries every layer, [batch x num_layers x layer_size], so ticking through a game matches running it whole
+        with tf.name_scope("step_network"):
+            self.step_inputs_ph = tf.placeholder(tf.float32, shape=[None, self.inputs_per_time_step], name='step_inputs')
+            self.step_state_ph = tf.placeholder(tf.float32, shape=[None, self.num_layers, self.layer_size], name='step_state')
+            state = tuple(tf.unstack(self.step_state_ph, axis=1))
+            output, next_state = self.multi_cell(self.step_inputs_ph, state) # the cells already own their variables
+            self.step_next_state = tf.stack(next_state, axis=1)
+
+            actions_raw = tf.reshape(fc(output, self.number_of_actions * 2, name='action', activation=None), [-1, self.number_of_actions, 2])
+            self.step_action_mu = tf.nn.sigmoid(actions_raw[:, :, 0])
+            self.step_action_sd = tf.nn.softplus(actions_raw[:, :, 1] + 1e-4)
+            step_dist = tf.contrib.distributions.Normal(self.step_action_mu, self.step_action_sd)
+            self.step_actions = tf.clip_by_value(step_dist.sample(), A_BOUND[0], A_BOUND[1])
+            self.step_value = fc(output, 1, name='value', activation=None)[:, 0]
+
     def update_policy(self):
         with tf.name_scope("policy_updates") as scope:
             # input placeholder = input
@@ -265,26 +332,79 @@ class Model:
             #self.merged = tf.summary.merge([self.value_loss_summary, self.policy_loss_summary])
             return self.value_train_op
 
+    def build_training_ops(self):
+        # Losses and train ops are built once, here, and shared by every worker
+        with self.graph.as_default(), tf.device(self.device):
+            self.update_policy()
+            self.update_value()
+
+            # Actor-critic update: policy and value gradients from one forward pass, applied together
+            with tf.name_scope("actor_critic_updates") as scope:
+                self.loss = self.policy_loss + self.value_loss_weight * self.value_loss
+                self.grads_and_vars = self.optimizer.compute_gradients(self.loss)
+                self.grads_and_vars = [[grad, var] for grad, var in self.grads_and_vars if grad is not None]
+                self.train_op = self.optimizer.apply_gradients(self.grads_and_vars, global_step=tf.train.get_global_step())
+                self.summaries = tf.summary.merge([self.policy_loss_summary, self.value_loss_summary])
+
+    def get_forward_fetches(self):
+        if self.naive:
+            return [self.action_mu, self.action_sd, self.actions, self.value_op]
+        return [self.action_mu, self.action_sd, self.actions, self.network_output, self.value_op]
+
+    def setup_rollout(self, sess, update_fetches):
+        # partial_run handle for one game: run the forward pass with get_actions_states_values(handle=...), then the
+        # update with sess.partial_run(handle, update_fetches, ...) on the same activations instead of recomputing them
+        feeds = [self.inputs_ph, self.policy_advantage, self.chosen_actions, self.discounted_rewards]
+        if not self.naive:
+            feeds.append(self.gru_state_ph)
+        return sess.partial_run_setup(self.get_forward_fetches() + list(update_fetches), feeds)
+
 
     # tf.contrib.distributions.Normal(1.,1.).log_prob()
 
-    def get_actions_states_values(self, sess, input_tensor, gru_state):
+    def get_actions_states_values(self, sess, input_tensor, gru_state, handle=None):
+        # handle - from setup_rollout, to keep the activations around for the update
+        run = sess.run if handle is None else lambda fetches, feed_dict: sess.partial_run(handle, fetches, feed_dict=feed_dict)
         states = [[]]
         if self.naive:
-            action_mus, action_sds, actions, values = sess.run([self.action_mu, self.action_sd, self.actions, self.value_op], feed_dict={self.inputs_ph: input_tensor})
+            action_mus, action_sds, actions, values = run(self.get_forward_fetches(), feed_dict={self.inputs_ph: input_tensor})
         else:
-            action_mus, action_sds, actions, states, values = sess.run([self.action_mu, self.action_sd, self.actions, self.network_output, self.value_op], feed_dict={self.inputs_ph: input_tensor, self.gru_state_ph: gru_state})
-        return action_mus, action_sds, actions, tuple(states[0]), values
+            action_mus, action_sds, actions, states, values = run(self.get_forward_fetches(), feed_dict={self.inputs_ph: input_tensor, self.gru_state_ph: gru_state})
+            if not self.dynamic:
+                states = [np.stack(states[0], axis=1)]
+        # states[0] is the GRU output at every step, [batch x seq x layer_size]
+        return action_mus, action_sds, actions, states[0], values
+
+    def initial_step_state(self, gru_state=None, batch_size=1):
+        # Step state from a gru_state as fed to gru_state_ph (every layer starts from it), or zeros
+        if gru_state is None:
+            return np.zeros([batch_size, self.num_layers, self.layer_size], dtype=np.float32)
+        gru_state = np.reshape(gru_state, [-1, self.layer_size])
+        return np.repeat(gru_state[:, None, :], self.num_layers, axis=1)
+
+    def step(self, sess, tick, state=None):
+        # tick = [batch x inputs per step] (or just [inputs per step]) -- the newest tick only
+        # Returns action mus, sds, sampled actions ([batch x # of actions]), values ([batch]) and the state for the next tick
+        tick = np.asarray(tick, dtype=np.float32)
+        if tick.ndim == 1:
+            tick = tick[None]
+        if self.naive:
+            # no hidden state; a one step sequence through the normal network
+            mu, sd, actions, values = sess.run([self.action_mu, self.action_sd, self.actions, self.value_op], feed_dict={self.inputs_ph: tick[:, None]})
+            return mu[:, 0], sd[:, 0], actions[:, 0], values[:, 0], None
+        if state is None:
+            state = self.initial_step_state(batch_size=len(tick))
+        return sess.run([self.step_action_mu, self.step_action_sd, self.step_actions, self.step_value, self.step_next_state],
+                        feed_dict={self.step_inputs_ph: tick, self.step_state_ph: state})
 
     def get_state(self):
         return self.last_input_state, self.gru_state_ph
 
+    # One off queries on the caller's session; for many concurrent callers use model.inference.InferenceService
     def get_value(self, sess, input, gru_state):
-        with tf.Session() as sess:
-            value = sess.run(self.value_op, feed_dict={self.inputs_ph: input, self.gru_state_ph: gru_state})
+        value = sess.run(self.value_op, feed_dict={self.inputs_ph: input, self.gru_state_ph: gru_state})
         return value, gru_state
 
     def get_policy(self, sess, input, gru_state):
-        with tf.Session() as sess:
-            policy = sess.run(self.policy_op, feed_dict={self.inputs_ph: input, self.gru_state_ph: gru_state})
+        policy = sess.run([self.action_mu, self.action_sd], feed_dict={self.inputs_ph: input, self.gru_state_ph: gru_state})
         return policy, gru_state
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from model.model import LR
+
+# Process based A3C: every worker process has its own Exchange, graph and session (so no shared GIL), and the global
+# parameters live in shared memory. Like original/worker.py, a worker copies the global parameters into its local
+# network before each game (make_copy_params_op) and applies its local gradients to the global parameters after it
+# (make_train_op) -- here the "global network" is a ParameterStore and the update is a shared RMSProp step on it.
+
+# Same settings as Model.optimizer
+RMS_DECAY = 0.99
+RMS_EPSILON = 1e-6
+CLIP_NORM = 5.0
+
+# spawn rather than fork: the parent already has a TensorFlow runtime. Shared objects have to come from the same context.
+CONTEXT = multiprocessing.get_context("spawn")
+
+class ParameterStore:
+    def __init__(self, variables, learning_rate=LR, lock=True):
+        # variables - the model's trainable variables; only their names and shapes are used
+        self.names = sorted(v.name for v in variables)
+        shapes = {v.name: tuple(v.shape.as_list()) for v in variables}
+        self.shapes = [shapes[name] for name in self.names]
+        sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        self.learning_rate = learning_rate
+
+        # RawArrays are only shared with processes started after this, as Process arguments
+        self.params_buffer = CONTEXT.RawArray("f", int(self.offsets[-1]))
+        self.mean_square_buffer = CONTEXT.RawArray("f", int(self.offsets[-1])) # shared RMSProp statistics
+        self.version_value = CONTEXT.RawValue("q", 0) # number of updates applied
+        self.lock = CONTEXT.Lock() if lock else None # without it updates are Hogwild style
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_views", None)
+        return state
+
+    def views(self):
+        # numpy views on the shared memory, made once per process
+        if getattr(self, "_views", None) is None:
+            self._views = (np.frombuffer(self.params_buffer, dtype=np.float32), np.frombuffer(self.mean_square_buffer, dtype=np.float32))
+        return self._views
+
+    @property
+    def version(self):
+        return self.version_value.value
+
+    def get(self):
+        # {name: copy of the current value}
+        params = self.views()[0]
+        if self.lock is not None:
+            with self.lock:
+                flat = params.copy()
+        else:
+            flat = params.copy()
+        return {name: flat[self.offsets[n]:self.offsets[n + 1]].reshape(shape) for n, (name, shape) in enumerate(zip(self.names, self.shapes))}
+
+    def set(self, values):
+        params = self.views()[0]
+        for n, name in enumerate(self.names):
+            params[self.offsets[n]:self.offsets[n + 1]] = np.ravel(values[name])
+
+    def publish(self, values):
+        # replace every parameter at once (e.g. with a learner's), as one more version
+        params = self.views()[0]
+        flat = np.concatenate([np.ravel(values[name]) for name in self.names])
+        if self.lock is not None:
+            with self.lock:
+                params[:] = flat
+                self.version_value.value += 1
+        else:
+            params[:] = flat
+            self.version_value.value += 1
+
+    def apply_gradients(self, grads):
+        # grads - {name: gradient}; variables without one are left alone
+        params, mean_square = self.views()
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            for n, name in enumerate(self.names):
+                if name not in grads:
+                    continue
+                grad = np.ravel(grads[name])
+                sl = slice(self.offsets[n], self.offsets[n + 1])
+                mean_square[sl] = RMS_DECAY * mean_square[sl] + (1 - RMS_DECAY) * np.square(grad)
+                params[sl] -= self.learning_rate * grad / np.sqrt(mean_square[sl] + RMS_EPSILON)
+            self.version_value.value += 1
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+
+def make_copy_params_op(model, store):
+    # Placeholders + assign ops that load the store's parameters into the model's variables
+    with model.graph.as_default():
+        variables = {v.name: v for v in model.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)}
+        placeholders = {}
+        update_ops = []
+        for name, shape in zip(store.names, store.shapes):
+            placeholders[name] = tf.placeholder(tf.float32, shape=shape, name="copy_" + name.replace(":", "_"))
+            update_ops.append(variables[name].assign(placeholders[name]))
+    return placeholders, tf.group(*update_ops)
+
+def make_train_op(model, train_value=False):
+    # The model's local gradients, clipped by global norm as in original/worker.py; returns (names, gradient tensors)
+    grads_and_vars = model.grads_and_vars if train_value else model.policy_grads_and_vars
+    with model.graph.as_default():
+        local_grads, variables = zip(*grads_and_vars)
+        local_grads, _ = tf.clip_by_global_norm(local_grads, CLIP_NORM)
+    return [v.name for v in variables], list(local_grads)
+
+def copy_params(sess, model, store, copy_params_op):
+    placeholders, op = copy_params_op
+    values = store.get()
+    sess.run(op, feed_dict={placeholders[name]: values[name] for name in store.names})
+
+class SharedCounter:
+    # Global game counter across processes; next() and str() behave like itertools.count, which Worker.run relies on
+    def __init__(self, start=1):
+        self.value = CONTEXT.Value("q", start)
+
+    def __next__(self):
+        with self.value.get_lock():
+            current = self.value.value
+            self.value.value += 1
+        return current
+
+    def __str__(self):
+        return "count({})".format(self.value.value)
+
+def run_worker_process(worker_id, store, counter, model_params, worker_params, train_dir=None):
+    # Entry point of one worker process: build a local model and exchange, then play and push gradients until T_max
+    from model.model import Model
+    from model.worker import Worker
+
+    np.random.seed((os.getpid() * 7919 + worker_id) % 2**32)
+    model = Model(**model_params)
+    summary_writer = tf.summary.FileWriter(train_dir) if worker_id == 0 and train_dir is not None else None
+    worker = Worker(global_model=model, T=counter, summary_writer=summary_writer, param_store=store, **worker_params)
+
+    # one core per process
+    config = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+    with tf.Session(graph=model.graph, config=config) as sess:
+        worker.run(sess, tf.train.Coordinator())
+    if summary_writer is not None:
+        summary_writer.close()
+
+def start_processes(target, args_list):
+    # spawn would normally re-run the launching script (e.g. train.py, which has no __main__ guard) in every child;
+    # the targets here only need their own modules, so hide the script while the children start
+    main = sys.modules["__main__"]
+    hidden = {name: main.__dict__.get(name) for name in ("__file__", "__spec__")}
+    main.__dict__.pop("__file__", None)
+    main.__spec__ = None
+    try:
+        processes = []
+        for args in args_list:
+            process = CONTEXT.Process(target=target, args=args, daemon=True)
+            process.start()
+            processes.append(process)
+    finally:
+        main.__dict__.update({name: value for name, value in hidden.items() if value is not None})
+    return processes
+
+def start_worker_processes(number_of_workers, store, counter, model_params, worker_params, train_dir=None):
+    return start_processes(run_worker_process, [(worker_id, store, counter, model_params, worker_params, train_dir)
+                                                for worker_id in range(number_of_workers)])
+
+def benchmark_processes(worker_counts=None, seconds=60, t_max=100, data=None):
+    # Games/sec for increasing numbers of worker processes
+    from model.model import Model
+    from model.worker import DATA
+    if worker_counts is None:
+        worker_counts = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= multiprocessing.cpu_count()]
+    results = {}
+    for count in worker_counts:
+        model_params = {"seq_length": t_max}
+        m = Model(**model_params)
+        with m.graph.as_default():
+            init = tf.global_variables_initializer()
+        store = ParameterStore(m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES))
+        with tf.Session(graph=m.graph) as sess:
+            sess.run(init)
+            store.set({v.name: value for v, value in zip(m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES),
+                                                         sess.run(m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)))})
+        counter = SharedCounter()
+        worker_params = {"T_max": 10**12, "t_max": t_max, "states_to_prime": t_max, "data": data or DATA}
+        processes = start_worker_processes(count, store, counter, model_params, worker_params)
+        while counter.value.value <= count: # wait until every process is up and playing
+            time.sleep(1)
+        start_games, start_time = counter.value.value, time.time()
+        time.sleep(seconds)
+        results[count] = (counter.value.value - start_games) / (time.time() - start_time)
+        for process in processes:
+            process.terminate()
+        print("{:3d} processes: {:8.1f} games/sec".format(count, results[count]))
+    return results
@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+
+# Experience replay for off-policy updates (ACER style: every on-policy update is followed by replay_ratio updates on
+# stored games, corrected for the policy having moved on). A game is stored by its starting state only -- its inputs are
+# gathered again from the exchange's shared price arrays when it is replayed -- plus what can't be recomputed: the GRU
+# state it started from, the actions taken, the behaviour policy that took them and the rewards.
+# Everything lives in preallocated float32 arrays used as a ring buffer, so the oldest games are overwritten first.
+
+REPLAY_CAPACITY = 10000
+PRIORITY_ALPHA = .6 # 0 is uniform sampling
+PRIORITY_BETA = .4 # importance weight correction for prioritized sampling; 1 corrects fully
+PRIORITY_EPSILON = 1e-3 # so every game keeps some chance of being replayed
+
+class ReplayBuffer:
+    def __init__(self, t_max, number_of_actions=1, layer_size=64, capacity=REPLAY_CAPACITY, prioritized=False,
+                 alpha=PRIORITY_ALPHA, beta=PRIORITY_BETA):
+        self.capacity = capacity
+        self.t_max = t_max
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+
+        self.start_states = np.zeros(capacity, dtype=np.int64)
+        self.gru_states = np.zeros([capacity, layer_size], dtype=np.float32)
+        self.chosen_actions = np.zeros([capacity, t_max, number_of_actions], dtype=np.float32)
+        self.action_mu = np.zeros([capacity, t_max, number_of_actions], dtype=np.float32)
+        self.action_sd = np.zeros([capacity, t_max, number_of_actions], dtype=np.float32)
+        self.rewards = np.zeros([capacity, t_max], dtype=np.float32)
+        self.priorities = np.zeros(capacity, dtype=np.float64) # already raised to alpha
+        self.max_priority = 1.
+
+        self.size = 0
+        self.next = 0 # where the next game goes
+        self.added = 0
+        self.sampled = 0
+        self.lock = threading.Lock()
+
+    def add(self, start_states, gru_states, chosen_actions, action_mu, action_sd, rewards):
+        # A batch of games, [games x ...]; new games get the highest priority so far, so each is replayed soon
+        games = len(chosen_actions)
+        with self.lock:
+            indices = (self.next + np.arange(games)) % self.capacity
+            self.start_states[indices] = np.broadcast_to(start_states, (games,))
+            self.gru_states[indices] = gru_states
+            self.chosen_actions[indices] = chosen_actions
+            self.action_mu[indices] = action_mu
+            self.action_sd[indices] = action_sd
+            self.rewards[indices] = rewards
+            self.priorities[indices] = self.max_priority
+            self.next = (self.next + games) % self.capacity
+            self.size = min(self.size + games, self.capacity)
+            self.added += games
+        return indices
+
+    def sample(self, batch_size):
+        # Returns the games' indices, their stored arrays and importance weights (all 1 for uniform sampling)
+        with self.lock:
+            if self.prioritized:
+                probabilities = self.priorities[:self.size] / self.priorities[:self.size].sum()
+                indices = np.random.choice(self.size, batch_size, p=probabilities)
+                weights = (self.size * probabilities[indices]) ** -self.beta
+                weights = weights / weights.max()
+            else:
+                indices = np.random.randint(self.size, size=batch_size)
+                weights = np.ones(batch_size)
+            games = {"start_states": self.start_states[indices], "gru_states": self.gru_states[indices],
+                     "chosen_actions": self.chosen_actions[indices], "action_mu": self.action_mu[indices],
+                     "action_sd": self.action_sd[indices], "rewards": self.rewards[indices]}
+            self.sampled += batch_size
+        return indices, games, weights
+
+    def update_priorities(self, indices, priorities):
+        # e.g. the mean absolute advantage of each replayed game
+        priorities = (np.asarray(priorities, dtype=np.float64) + PRIORITY_EPSILON) ** self.alpha
+        with self.lock:
+            self.priorities[indices] = priorities
+            self.max_priority = max(self.max_priority, priorities.max())
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.start_states, self.gru_states, self.chosen_actions, self.action_mu,
+                                              self.action_sd, self.rewards, self.priorities))
+
+    def get_stats(self, inputs_per_time_step=None):
+        stats = {"size": self.size, "capacity": self.capacity, "added": self.added, "sampled": self.sampled,
+                 "replay_ratio": self.sampled / self.added if self.added else 0., "megabytes": self.nbytes() / 2**20}
+        if inputs_per_time_step is not None:
+            # what storing every game's float32 inputs as well would have added
+            stats["inputs_megabytes"] = self.capacity * self.t_max * inputs_per_time_step * 4 / 2**20
+        return stats
+
+    def print_stats(self, inputs_per_time_step=None):
+        stats = self.get_stats(inputs_per_time_step)
+        print("Replay: {size}/{capacity} games, {added} added, {sampled} replayed ({replay_ratio:.2f} per game), "
+              "{megabytes:.1f} MB".format(**stats) +
+              (" (storing inputs would add {inputs_megabytes:.1f} MB)".format(**stats) if "inputs_megabytes" in stats else ""))
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Returns and advantages over [batch x t] rewards, values and terminal masks, without a Python loop per step.
+# dones[b, t] = 1 means game b ended after step t, so nothing after t is discounted back into it.
+# bootstrap[b] is the value of the state after the last step (0 if not given, e.g. the game ended there).
+#
+# All of them come down to the reverse recurrence y[t] = x[t] + g[t] * (1 - dones[t]) * y[t+1], y[T] = bootstrap, where g is
+# the discount (or a [batch x t] array of per step discounts, e.g. discount * lam or V-trace's discount * c).
+# Within a game that is y[t] = P[t]^-1 * sum over k >= t of P[k] * x[k] with P[k] = g[0] * ... * g[k-1], i.e. a reverse
+# cumulative sum of scaled x; dones cut the sums at the end of each game. P is kept above MIN_SCALE by working through
+# the steps in blocks, carrying y at the start of each block back into the one before it.
+
+MIN_SCALE = 1e-200
+BLOCK_ELEMENTS = 2**16
+
+def discounted_sum(x, discount, dones=None, bootstrap=None):
+    x = np.asarray(x, dtype="float64")
+    batch, length = x.shape
+    g = np.asarray(discount, dtype="float64")
+    if bootstrap is not None:
+        # the bootstrap value is one more step after the last
+        x = np.concatenate([x, np.broadcast_to(np.asarray(bootstrap, dtype="float64"), (batch,))[:, None]], axis=1)
+        if dones is not None:
+            dones = np.concatenate([dones, np.zeros((batch, 1))], axis=1)
+        if g.ndim:
+            g = np.concatenate([g, np.ones((batch, 1))], axis=1)
+    if not g.any():
+        return x[:, :length].copy()
+    if g.ndim and not g.all():
+        # a zero discount cuts the sum just like the end of a game does; as a scale it would zero P for every later step
+        zero = g == 0
+        dones = zero if dones is None else (np.asarray(dones) > 0) | zero
+        g = np.where(zero, 1., g)
+
+    steps = x.shape[1]
+    block = max(16, BLOCK_ELEMENTS // batch) # keep a block's temporaries in cache
+    smallest = g[g > 0].min()
+    if smallest < 1:
+        block = min(block, max(1, int(np.log(MIN_SCALE) / np.log(smallest))))
+    y = np.empty((batch, steps))
+    carry = np.zeros(batch) # y at the start of the following block
+    for end in range(steps, 0, -block):
+        start = max(0, end - block)
+        n = end - start
+        if g.ndim:
+            scale = np.concatenate([np.ones((batch, 1)), np.cumprod(g[:, start:end], axis=1)], axis=1)
+        else:
+            scale = (g ** np.arange(n + 1))[None, :]
+        sums = np.cumsum((x[:, start:end] * scale[:, :n])[:, ::-1], axis=1)[:, ::-1]
+        carried = scale[:, n:] / scale[:, :n] * carry[:, None] # g[t] * ... * g[n-1] * carry
+        if dones is not None:
+            # index of the first done at or after t within the block, n if there is none
+            game_end = np.where(np.asarray(dones[:, start:end]) > 0, np.arange(n), n)
+            game_end = np.minimum.accumulate(game_end[:, ::-1], axis=1)[:, ::-1]
+            # drop everything after the end of t's game
+            sums = sums - np.take_along_axis(np.concatenate([sums, np.zeros((batch, 1))], axis=1), np.minimum(game_end + 1, n), axis=1)
+            carried = np.where(game_end == n, carried, 0.)
+        y[:, start:end] = sums / scale[:, :n] + carried
+        carry = y[:, start]
+    return y[:, :length]
+
+def discounted_returns(rewards, discount, bootstrap=None, dones=None):
+    # R[t] = r[t] + discount * R[t+1]
+    return discounted_sum(rewards, discount, dones, bootstrap)
+
+def n_step_returns(rewards, values, discount, n, bootstrap=None, dones=None):
+    # G[t] = r[t] + ... + discount^(n-1) * r[t+n-1] + discount^n * V[t+n], cut short by the end of the game or of the data
+    #      = R[t] - discount^n * (R[t+n] - V[t+n])
+    rewards = np.asarray(rewards)
+    batch, length = rewards.shape
+    end = np.zeros(batch) if bootstrap is None else np.broadcast_to(np.asarray(bootstrap, dtype="float64"), (batch,))
+
+    returns = discounted_sum(rewards, discount, dones, end)
+    # past the last step both R and V are the bootstrap value, so the correction vanishes there
+    later_returns = np.concatenate([returns[:, n:], np.repeat(end[:, None], min(n, length), axis=1)], axis=1)
+    later_values = np.concatenate([np.asarray(values, dtype="float64")[:, n:], np.repeat(end[:, None], min(n, length), axis=1)], axis=1)
+    t = np.arange(length)
+    scale = np.broadcast_to(discount ** np.minimum(n, length - t), (batch, length))
+    if dones is not None:
+        # no correction if the game ends within the n steps
+        ended = np.concatenate([np.zeros((batch, 1)), np.cumsum(dones, axis=1)], axis=1)
+        scale = np.where(ended[:, np.minimum(t + n, length)] - ended[:, t] > 0, 0., scale)
+    return returns - scale * (later_returns - later_values)
+
+def gae(rewards, values, discount, lam, bootstrap=None, dones=None):
+    # Generalized advantage estimation: A[t] = delta[t] + discount * lam * A[t+1], delta[t] = r[t] + discount * V[t+1] - V[t]
+    # Returns the advantages and the value targets A + V
+    rewards = np.asarray(rewards)
+    values = np.asarray(values, dtype="float64")
+    batch = rewards.shape[0]
+    end = np.zeros(batch) if bootstrap is None else np.broadcast_to(np.asarray(bootstrap, dtype="float64"), (batch,))
+    next_values = np.concatenate([values[:, 1:], end[:, None]], axis=1)
+    if dones is not None:
+        next_values = next_values * (1. - np.asarray(dones, dtype="float64"))
+    deltas = rewards + discount * next_values - values
+    advantages = discounted_sum(deltas, discount * lam, dones)
+    return advantages, advantages + values
+
+def vtrace(behaviour_log_probs, target_log_probs, rewards, values, discount, bootstrap=None, dones=None,
+           clip_rho=1., clip_pg_rho=1., clip_c=1.):
+    # V-trace targets for off-policy actor-critic (IMPALA, Espeholt et al. 2018), with lambda = 1
+    # log probs are [batch x t] (or [batch x t x # of actions], summed over the actions) of the actions taken, under the
+    # policy that played them (behaviour) and the one being trained (target)
+    # Returns the value targets vs and the policy gradient advantages
+    log_rhos = np.asarray(target_log_probs, dtype="float64") - np.asarray(behaviour_log_probs, dtype="float64")
+    if log_rhos.ndim == 3:
+        log_rhos = log_rhos.sum(axis=2)
+    rhos = np.exp(log_rhos)
+    rewards = np.asarray(rewards, dtype="float64")
+    values = np.asarray(values, dtype="float64")
+    batch = rewards.shape[0]
+    end = np.zeros(batch) if bootstrap is None else np.broadcast_to(np.asarray(bootstrap, dtype="float64"), (batch,))
+    alive = 1. if dones is None else 1. - np.asarray(dones, dtype="float64")
+
+    # vs[t] - V[t] = rho[t] * delta[t] + discount * c[t] * (vs[t+1] - V[t+1])
+    next_values = np.concatenate([values[:, 1:], end[:, None]], axis=1) * alive
+    deltas = np.minimum(clip_rho, rhos) * (rewards + discount * next_values - values)
+    vs = values + discounted_sum(deltas, discount * np.minimum(clip_c, rhos), dones)
+
+    next_vs = np.concatenate([vs[:, 1:], end[:, None]], axis=1) * alive
+    advantages = np.minimum(clip_pg_rho, rhos) * (rewards + discount * next_vs - values)
+    return vs, advantages
@@ -0,0 +1,64 @@
+import threading
+
+# GRU states at regular anchor points along the dataset, so a game doesn't have to prime over states_to_prime trades.
+# A game starting at state s warm starts from the state cached at anchor(s) = s - s % anchor_every and only replays the
+# gap [anchor, s). Entries remember the parameter version that computed them; once the parameters have moved on by
+# more than max_staleness updates an entry is recomputed (from zeros over states_to_prime trades, as before).
+# With a parameter store (process mode), the store's version is the parameter version: every process' updates count.
+
+ANCHOR_EVERY = 100
+MAX_STALENESS = 50
+
+class HiddenStateCache:
+    def __init__(self, anchor_every=ANCHOR_EVERY, max_staleness=MAX_STALENESS, param_store=None):
+        self.anchor_every = anchor_every
+        self.max_staleness = max_staleness
+        self.states = {} # anchor -> (gru state, version)
+        self.updates = 0 # number of parameter updates so far, without a store
+        self.param_store = param_store
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def anchor(self, state):
+        return state - state % self.anchor_every
+
+    @property
+    def version(self):
+        if self.param_store is not None:
+            return self.param_store.version
+        return self.updates
+
+    def bump_version(self, updates=1):
+        # call after every parameter update; the store already counts its own
+        with self.lock:
+            self.updates += updates
+
+    def get(self, anchor):
+        # the cached state at anchor, or None if there isn't a fresh enough one
+        with self.lock:
+            entry = self.states.get(anchor)
+            if entry is None:
+                self.misses += 1
+                return None
+            state, version = entry
+            if self.version - version > self.max_staleness:
+                self.stale += 1
+                return None
+            self.hits += 1
+            return state
+
+    def put(self, anchor, state):
+        with self.lock:
+            self.states[anchor] = (state, self.version)
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.stale
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "entries": len(self.states),
+                    "hit_rate": self.hits / lookups if lookups else 0., "version": self.version}
+
+    def print_stats(self):
+        print("State cache: hit rate {hit_rate:.1%} ({hits} hits, {misses} misses, {stale} stale), {entries} anchors, "
+              "parameter version {version}".format(**self.get_stats()))
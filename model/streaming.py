@@ -0,0 +1,61 @@
+import time
+import collections
+import numpy as np
+from model.inference import LATENCY_WINDOW
+
+# Live inference one tick at a time: keeps the GRU state between calls, so each new trade costs one cell step
+# instead of re-priming over states_to_prime trades and rerunning the game window.
+#
+#   stream = StreamingPolicy(m, sess)
+#   stream.prime(history)      # [seq x inputs per step], once
+#   for tick in ticks:
+#       result = stream.tick(tick)  # {"action_mu", "action_sd", "action", "value"}
+#   stream.print_stats()
+
+class StreamingPolicy:
+    def __init__(self, model, sess, gru_state=None):
+        self.model = model
+        self.sess = sess
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.reset(gru_state)
+
+    def reset(self, gru_state=None):
+        # gru_state as fed to gru_state_ph, e.g. from Worker.prime_gru; zeros if not given
+        self.state = None if self.model.naive else self.model.initial_step_state(gru_state)
+        self.ticks = 0
+
+    def prime(self, history):
+        # Run the history through once to get the state at its end; later ticks continue from there
+        history = np.asarray(history, dtype=np.float32)
+        if self.model.naive:
+            return
+        m = self.model
+        if m.dynamic:
+            final_state = self.sess.run(m.network_output[1], feed_dict={m.inputs_ph: history[None], m.gru_state_ph: np.zeros([1, m.layer_size])})
+            self.state = np.stack(final_state, axis=1)
+        else:
+            # the unrolled graph only takes seq_length steps at a time, so step through instead
+            for tick in history:
+                self.state = m.step(self.sess, tick, self.state)[4]
+
+    def tick(self, tick):
+        start = time.time()
+        mu, sd, action, value, self.state = self.model.step(self.sess, tick, self.state)
+        self.latencies.append(time.time() - start)
+        self.ticks += 1
+        return {"action_mu": mu[0], "action_sd": sd[0], "action": action[0], "value": value[0]}
+
+    def get_stats(self):
+        latencies = np.array(self.latencies) * 1000
+        stats = {"ticks": self.ticks}
+        if len(latencies):
+            stats["p50_ms"], stats["p99_ms"] = np.percentile(latencies, [50, 99])
+            stats["mean_ms"] = latencies.mean()
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        if not stats["ticks"]:
+            print("No ticks")
+            return
+        print("{ticks} ticks, p50 {p50_ms:.3f}ms, p99 {p99_ms:.3f}ms, mean {mean_ms:.3f}ms".format(**stats))
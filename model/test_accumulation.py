@@ -0,0 +1,63 @@
+import numpy as np
+import tensorflow as tf
+from model.model import Model
+from model.accumulation import GradientAccumulator, clip_by_global_norm
+
+# Run from the repo root: python -m unittest model.test_accumulation
+
+class AccumulationTest(tf.test.TestCase):
+    def testSameGameKTimesIsOneStep(self):
+        # the mean of K identical games' gradients is one game's gradient, so both sessions take the same step
+        m = Model(seq_length=10, layer_size=16)
+        accumulator = GradientAccumulator(m, 4, train_value=True)
+        with m.graph.as_default():
+            init = [tf.global_variables_initializer(), tf.local_variables_initializer()]
+        variables = m.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        trainable = m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
+        feed_dict = {m.inputs_ph: np.random.randn(2, 10, 2), m.gru_state_ph: np.zeros([2, m.layer_size]),
+                     m.chosen_actions: np.random.rand(2, 10, 1), m.policy_advantage: np.random.randn(2, 10),
+                     m.discounted_rewards: np.random.randn(2, 10)}
+
+        with tf.Session(graph=m.graph) as direct, tf.Session(graph=m.graph) as accumulated:
+            direct.run(init)
+            accumulated.run(init)
+            for variable, value in zip(variables, direct.run(variables)):
+                variable.load(value, accumulated)
+            accumulated.run(accumulator.reset_op)
+
+            direct.run(m.train_op, feed_dict=feed_dict)
+            for _ in range(4):
+                accumulated.run(accumulator.accumulate_op, feed_dict=feed_dict)
+            self.assertEqual(accumulated.run(accumulator.count), 4)
+            self.assertEqual([accumulator.add_games() for _ in range(4)], [False, False, False, True])
+            accumulated.run(accumulator.apply_op)
+
+            for a, b in zip(direct.run(trainable), accumulated.run(trainable)):
+                self.assertAllClose(a, b, rtol=1e-5, atol=1e-6)
+            self.assertEqual(accumulated.run(accumulator.count), 0)
+
+    def testInitializersLeaveAccumulatorsAlone(self):
+        # another worker initializing the graph must not drop the games accumulated so far
+        m = Model(seq_length=10, layer_size=16)
+        accumulator = GradientAccumulator(m, 2, train_value=True)
+        with m.graph.as_default():
+            init = [tf.global_variables_initializer(), tf.local_variables_initializer()]
+        feed_dict = {m.inputs_ph: np.random.randn(1, 10, 2), m.gru_state_ph: np.zeros([1, m.layer_size]),
+                     m.chosen_actions: np.random.rand(1, 10, 1), m.policy_advantage: np.random.randn(1, 10),
+                     m.discounted_rewards: np.random.randn(1, 10)}
+        with tf.Session(graph=m.graph) as sess:
+            sess.run(init)
+            sess.run(accumulator.reset_op)
+            sess.run(accumulator.accumulate_op, feed_dict=feed_dict)
+            sess.run(init)
+            self.assertEqual(sess.run(accumulator.count), 1)
+
+    def testClipByGlobalNorm(self):
+        grads = {"a": np.array([3., 0.]), "b": np.array([4.])}
+        clipped = clip_by_global_norm(grads, 1.)
+        self.assertAllClose(clipped["a"], [.6, 0.])
+        self.assertAllClose(clipped["b"], [.8])
+        self.assertIs(clip_by_global_norm(grads, 10.), grads)
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,44 @@
+import numpy as np
+import tensorflow as tf
+from model.model import Model
+from model.distributed import worker_device, restore_or_initialize, wait_until_ready, GameCounter
+
+# Run from the repo root: python -m unittest model.test_distributed
+
+class DistributedTest(tf.test.TestCase):
+    # Two worker tasks and a ps task in this process, on localhost ports
+
+    def update(self, sess, m):
+        feed_dict = {m.inputs_ph: np.random.randn(1, 10, 2), m.gru_state_ph: np.zeros([1, m.layer_size]),
+                     m.chosen_actions: np.random.rand(1, 10, 1), m.policy_advantage: np.random.randn(1, 10),
+                     m.discounted_rewards: np.random.randn(1, 10)}
+        sess.run(m.train_op, feed_dict=feed_dict)
+
+    def testSharedVariablesAndCounts(self):
+        workers, _ = tf.test.create_local_cluster(num_workers=2, num_ps=1)
+        cluster = tf.train.ClusterSpec(workers[0].server_def.cluster)
+        models = [Model(seq_length=10, layer_size=16, device=worker_device(cluster, n)) for n in range(2)]
+        sessions = [tf.Session(worker.target, graph=m.graph) for worker, m in zip(workers, models)]
+
+        restore_or_initialize(sessions[0], models[0], self.get_temp_dir())
+        wait_until_ready(sessions[1], models[1])
+        counters = [GameCounter(sess, m) for sess, m in zip(sessions, models)]
+        self.assertEqual(str(counters[1]), "count(1)")
+
+        # an update from either task moves the one global step, a game from either the one game count, and both see the
+        # same parameters
+        for sess, m in zip(sessions, models):
+            self.update(sess, m)
+        self.assertEqual(sessions[1].run(models[1].global_step), 2)
+        self.assertEqual(next(counters[0]), 1)
+        self.assertEqual(next(counters[1]), 2)
+        self.assertEqual(str(counters[0]), "count(3)")
+        variables = [m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES) for m in models]
+        for a, b in zip(sessions[0].run(variables[0]), sessions[1].run(variables[1])):
+            self.assertAllEqual(a, b)
+
+        for sess in sessions:
+            sess.close()
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,77 @@
+import numpy as np
+import tensorflow as tf
+from model.model import Model
+
+# Run from the repo root: python -m unittest model.test_model
+
+class VariableShapeTest(tf.test.TestCase):
+    # One set of weights has to give the same outputs whatever batch size / sequence length it is fed
+
+    def run_model(self, sess, m, inputs, gru_state=None):
+        feed_dict = {m.inputs_ph: m.format_inputs(inputs)}
+        if not m.naive:
+            if gru_state is None:
+                gru_state = np.zeros([len(inputs), m.layer_size], dtype=np.float32)
+            feed_dict[m.gru_state_ph] = gru_state
+        return sess.run([m.action_mu, m.action_sd, m.value_op], feed_dict=feed_dict)
+
+    def check_shapes(self, m, inputs_per_step):
+        with m.graph.as_default():
+            init = tf.global_variables_initializer()
+        with tf.Session(graph=m.graph) as sess:
+            sess.run(init)
+            games = np.random.randn(4, 30, inputs_per_step).astype(np.float32)
+
+            # Batch of 4 == 4 single games
+            batch_mu, batch_sd, batch_value = self.run_model(sess, m, games)
+            for n, game in enumerate(games):
+                mu, sd, value = self.run_model(sess, m, game[None])
+                self.assertAllClose(mu[0], batch_mu[n], rtol=1e-5, atol=1e-6)
+                self.assertAllClose(sd[0], batch_sd[n], rtol=1e-5, atol=1e-6)
+                self.assertAllClose(value[0], batch_value[n], rtol=1e-5, atol=1e-6)
+
+            # Shorter game == the start of the longer one, and a single step works too
+            for length in (1, 10):
+                mu, sd, value = self.run_model(sess, m, games[:, :length])
+                self.assertEqual(value.shape, (4, length))
+                self.assertAllClose(mu, batch_mu[:, :length], rtol=1e-5, atol=1e-6)
+                self.assertAllClose(value, batch_value[:, :length], rtol=1e-5, atol=1e-6)
+
+    def testGRU(self):
+        self.check_shapes(Model(seq_length=30, layer_size=16), inputs_per_step=2)
+
+    def testNaive(self):
+        self.check_shapes(Model(seq_length=30, layer_size=16, naive=True, inputs_per_time_step=6), inputs_per_step=6)
+
+    def testUnrolledKeepsFixedShape(self):
+        m = Model(seq_length=30, layer_size=16, dynamic=False)
+        self.assertEqual(m.inputs_ph.shape.as_list(), [1, 60])
+
+class StepTest(tf.test.TestCase):
+    # Ticking through a game one step at a time has to match running the whole game at once
+
+    def check_steps(self, m):
+        with m.graph.as_default():
+            init = tf.global_variables_initializer()
+        with tf.Session(graph=m.graph) as sess:
+            sess.run(init)
+            games = np.random.randn(3, 20, m.inputs_per_time_step).astype(np.float32)
+            gru_state = np.random.randn(3, m.layer_size).astype(np.float32)
+            mu, value, (outputs, final_state) = sess.run([m.action_mu, m.value_op, m.network_output],
+                                                        feed_dict={m.inputs_ph: games, m.gru_state_ph: gru_state})
+
+            state = m.initial_step_state(gru_state)
+            for t in range(games.shape[1]):
+                step_mu, step_sd, step_actions, step_value, state = m.step(sess, games[:, t], state)
+                self.assertAllClose(step_mu, mu[:, t], rtol=1e-5, atol=1e-6)
+                self.assertAllClose(step_value, value[:, t], rtol=1e-5, atol=1e-6)
+            self.assertAllClose(state, np.stack(final_state, axis=1), rtol=1e-5, atol=1e-6)
+
+    def testGRU(self):
+        self.check_steps(Model(seq_length=20, layer_size=16))
+
+    def testTwoLayers(self):
+        self.check_steps(Model(seq_length=20, layer_size=16, num_layers=2))
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from model.replay import ReplayBuffer
+
+# Run from the repo root: python -m unittest model.test_replay
+
+class ReplayTest(unittest.TestCase):
+    def add_games(self, replay, start_states):
+        games = len(start_states)
+        rewards = np.asarray(start_states, dtype=np.float32)[:, None] * np.ones([games, replay.t_max])
+        replay.add(start_states, np.zeros([games, 4]), np.zeros([games, replay.t_max, 1]), np.zeros([games, replay.t_max, 1]),
+                   np.ones([games, replay.t_max, 1]), rewards)
+
+    def testRingBuffer(self):
+        replay = ReplayBuffer(t_max=5, layer_size=4, capacity=6)
+        self.add_games(replay, [1, 2, 3, 4])
+        self.add_games(replay, [5, 6, 7, 8]) # overwrites the two oldest
+        self.assertEqual(replay.size, 6)
+        self.assertEqual(sorted(replay.start_states), [3, 4, 5, 6, 7, 8])
+        indices, games, weights = replay.sample(100)
+        self.assertTrue(np.all(games["start_states"] >= 3))
+        # everything stored for a game stays together
+        np.testing.assert_array_equal(games["rewards"][:, 0], games["start_states"])
+        np.testing.assert_array_equal(weights, 1.)
+
+    def testPrioritized(self):
+        np.random.seed(0)
+        replay = ReplayBuffer(t_max=5, layer_size=4, capacity=10, prioritized=True, alpha=1.)
+        self.add_games(replay, np.arange(10))
+        priorities = np.full(10, .01)
+        priorities[3] = 10.
+        replay.update_priorities(np.arange(10), priorities)
+        indices, games, weights = replay.sample(1000)
+        self.assertGreater(np.mean(indices == 3), .9)
+        # the most sampled game gets the smallest importance weight
+        self.assertEqual(weights.max(), 1.)
+        self.assertAlmostEqual(weights[indices == 3].max(), weights.min())
+
+    def testFootprint(self):
+        replay = ReplayBuffer(t_max=100, layer_size=64, capacity=1000)
+        stats = replay.get_stats(inputs_per_time_step=2)
+        self.assertAlmostEqual(stats["megabytes"], replay.nbytes() / 2**20)
+        self.assertEqual(replay.nbytes(), 1000 * (8 + 64 * 4 + 100 * 4 * 4 + 8))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+from model.returns import discounted_returns, n_step_returns, gae, vtrace
+
+# Run from the repo root: python -m unittest model.test_returns
+
+def loop_returns(rewards, values, discount, n, bootstrap, dones):
+    # step by step reference: n-step return at every step, stopping at the end of the game
+    batch, length = rewards.shape
+    out = np.zeros((batch, length))
+    for b in range(batch):
+        for t in range(length):
+            G, scale = 0., 1.
+            for k in range(t, min(t + n, length)):
+                G += scale * rewards[b, k]
+                scale *= discount * (1 - dones[b, k])
+            nxt = min(t + n, length)
+            G += scale * (bootstrap[b] if nxt == length else values[b, nxt])
+            out[b, t] = G
+    return out
+
+def loop_discounted_sum(x, discount, bootstrap, dones):
+    # y[t] = x[t] + discount[t] * (1 - dones[t]) * y[t+1] with per step discounts
+    batch, length = x.shape
+    y = np.zeros((batch, length))
+    for b in range(batch):
+        Y = bootstrap[b]
+        for t in reversed(range(length)):
+            Y = x[b, t] + discount[b, t] * (1 - dones[b, t]) * Y
+            y[b, t] = Y
+    return y
+
+def loop_gae(rewards, values, discount, lam, bootstrap, dones):
+    batch, length = rewards.shape
+    advantages = np.zeros((batch, length))
+    for b in range(batch):
+        A = 0.
+        for t in reversed(range(length)):
+            next_value = bootstrap[b] if t == length - 1 else values[b, t + 1]
+            g = discount * (1 - dones[b, t])
+            A = rewards[b, t] + g * next_value - values[b, t] + g * lam * A
+            advantages[b, t] = A
+    return advantages
+
+def loop_vtrace(log_rhos, rewards, values, discount, bootstrap, dones):
+    batch, length = rewards.shape
+    vs = np.zeros((batch, length))
+    for b in range(batch):
+        next_vs, next_value = bootstrap[b], bootstrap[b]
+        for t in reversed(range(length)):
+            if dones[b, t]:
+                next_vs, next_value = 0., 0.
+            rho = np.exp(log_rhos[b, t])
+            delta = min(1., rho) * (rewards[b, t] + discount * next_value - values[b, t])
+            vs[b, t] = values[b, t] + delta + discount * min(1., rho) * (next_vs - next_value)
+            next_vs, next_value = vs[b, t], values[b, t]
+    return vs
+
+class ReturnsTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.rewards = np.random.randn(5, 150) # longer than a block
+        self.values = np.random.randn(5, 150)
+        self.bootstrap = np.random.randn(5)
+        self.dones = (np.random.rand(5, 150) < .05).astype("float64")
+
+    def testDiscountedReturns(self):
+        for dones in (np.zeros_like(self.dones), self.dones):
+            expected = loop_returns(self.rewards, self.values, .9, 10**6, self.bootstrap, dones)
+            np.testing.assert_allclose(discounted_returns(self.rewards, .9, self.bootstrap, dones), expected, rtol=1e-10, atol=1e-10)
+
+    def testNoBootstrap(self):
+        expected = loop_returns(self.rewards, self.values, .7, 10**6, np.zeros(5), np.zeros_like(self.dones))
+        np.testing.assert_allclose(discounted_returns(self.rewards, .7), expected, rtol=1e-10, atol=1e-10)
+
+    def testNStepReturns(self):
+        for n in (1, 5, 200):
+            expected = loop_returns(self.rewards, self.values, .9, n, self.bootstrap, self.dones)
+            np.testing.assert_allclose(n_step_returns(self.rewards, self.values, .9, n, self.bootstrap, self.dones), expected, rtol=1e-10, atol=1e-10)
+
+    def testGAE(self):
+        expected = loop_gae(self.rewards, self.values, .9, .95, self.bootstrap, self.dones)
+        advantages, targets = gae(self.rewards, self.values, .9, .95, self.bootstrap, self.dones)
+        np.testing.assert_allclose(advantages, expected, rtol=1e-10, atol=1e-10)
+        np.testing.assert_allclose(targets, expected + self.values, rtol=1e-10, atol=1e-10)
+
+    def testVtrace(self):
+        behaviour = np.random.randn(5, 150) * .1
+        target = behaviour + np.random.randn(5, 150) * .5
+        vs, advantages = vtrace(behaviour, target, self.rewards, self.values, .9, self.bootstrap, self.dones)
+        np.testing.assert_allclose(vs, loop_vtrace(target - behaviour, self.rewards, self.values, .9, self.bootstrap, self.dones), rtol=1e-10, atol=1e-10)
+
+        # on-policy V-trace is the n-step (here full) return
+        vs, advantages = vtrace(behaviour, behaviour, self.rewards, self.values, .9, self.bootstrap, self.dones)
+        np.testing.assert_allclose(vs, discounted_returns(self.rewards, .9, self.bootstrap, self.dones), rtol=1e-10, atol=1e-10)
+
+    def testZeroDiscounts(self):
+        # per step discounts with zeros inside a block, e.g. V-trace's discount * c where c underflowed to 0
+        discount = np.random.uniform(.5, 1., (5, 150))
+        discount[np.random.rand(5, 150) < .1] = 0.
+        for dones in (np.zeros_like(self.dones), self.dones):
+            expected = loop_discounted_sum(self.rewards, discount, self.bootstrap, dones)
+            np.testing.assert_allclose(discounted_returns(self.rewards, discount, self.bootstrap, dones), expected, rtol=1e-10, atol=1e-10)
+        np.testing.assert_allclose(discounted_returns(np.ones((1, 6)), [[.9, .9, 0, .9, .9, .9]]), [[2.71, 1.9, 1, 2.71, 1.9, 1]])
+
+        advantages, targets = gae(self.rewards, self.values, np.where(discount > 0, .9, 0.), 1, self.bootstrap)
+        self.assertTrue(np.isfinite(advantages).all())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,13 @@
 import tensorflow as tf
 import numpy as np
 from threading import Thread
-from exchange import Exchange
+from exchange import Exchange, VectorizedExchange
 from model.model import Model
+from model.ga3c import Experience
+from model.returns import discounted_returns
+from model.parameter_store import make_copy_params_op, make_train_op, copy_params
+from model.accumulation import GradientAccumulator, clip_by_global_norm
+from model.impala import add_vtrace_targets
 
 ## Problems:
 # Final Value always less than initial value
@@ -21,14 +26,26 @@ DATA = r"./data/BTC-USD_SHORT.npy"
 DATA = r"./data/BTC_USD_100_FREQ.npy"
 
 EXPERIMENT = True
+TRAIN_VALUE = False # the value net is ignored in update() for now
+REUSE_FORWARD = False # run the update on the forward pass' activations (partial_run) instead of recomputing them
+ROLLOUTS = 1 # games played from each primed state, as one batch
+SYNC_GAMES = 1 # games played from different states at once, as one batch (synchronous A2C)
+ACCUMULATE_GAMES = 1 # updates (games, or batches of them) whose gradients go into one optimizer step
+REPLAY_RATIO = 1. # replayed games per new game, with a replay buffer
+REPLAY_BATCH_SIZE = 8 # games per replay update
 
 # Each worker needs his own exchange -- needs to be some coordination to explore the exchange
 # Train should have some logic to randomly move around the reinforcement space?
 # Make some toy data
 
 class Worker(Thread):
-    def __init__(self, global_model, T, T_max, t_max=1000, states_to_prime = 1000, summary_writer=None, data = DATA):
+    def __init__(self, global_model, T, T_max, t_max=1000, states_to_prime = 1000, summary_writer=None, data = DATA,
+                 train_value=TRAIN_VALUE, reuse_forward=REUSE_FORWARD, predictor=None, trainer=None,
+                 state_cache=None, rollouts=ROLLOUTS, param_store=None, init_variables=True, sync_games=SYNC_GAMES,
+                 accumulate_games=ACCUMULATE_GAMES, clip_norm=None, accumulator=None, replay=None, replay_ratio=REPLAY_RATIO,
+                 replay_batch_size=REPLAY_BATCH_SIZE):
         self.previous = None # for testing if input is the same
+        self.games_played = 0 # by this worker, whether or not T is counted (e.g. T_max=None)
         self.t = tf.Variable(initial_value=1, trainable=False)
         self.T = T
         self.T_max = T_max
@@ -46,10 +63,86 @@ class Worker(Thread):
         self.model = self.global_model
 
         self.summary_writer = summary_writer
+        self.init_variables = init_variables # False if someone else owns the variables (train.py, GA3C trainer, distributed chief)
 
-        # Each worker has an exchange; can be reset to any state
-        self.exchange = Exchange(data, time_interval=1, game_length=self.t_max, naive_price_history=self.model.input_size,naive_inputs=self.model.inputs_per_time_step )
-
+        # Training ops are built once by the model; this picks which ones a game's update runs
+        self.train_value = train_value
+        self.reuse_forward = reuse_forward
+        if self.train_value:
+            self.update_fetches = [self.model.train_op, self.model.summaries, self.model.policy_loss, self.model.value_loss]
+        else:
+            self.update_fetches = [self.model.policy_train_op, self.model.policy_loss_summary, self.model.policy_loss]
+        self.handle = None
+
+        # GA3C mode (model.ga3c): forward passes go through a shared Predictor and updates through a shared Trainer
+        self.predictor = predictor
+        self.trainer = trainer
+
+        # Warm start priming from GRU states cached at anchor points (model.state_cache); the gap replays need any length
+        self.state_cache = state_cache
+        if self.state_cache is not None and not self.naive and not self.model.dynamic:
+            raise ValueError("The hidden state cache needs a dynamic GRU model")
+
+        # Process based A3C (model.parameter_store): this worker's model is a local copy; parameters are pulled from
+        # the shared store before each game and gradients pushed to it after
+        self.param_store = param_store
+        if self.param_store is not None:
+            self.copy_params_op = make_copy_params_op(self.model, self.param_store)
+            self.gradient_names, self.gradient_ops = make_train_op(self.model, self.train_value)
+            if self.state_cache is not None:
+                self.state_cache.param_store = self.param_store # updates from every process age the cached states
+
+        # Gradient accumulation (model.accumulation): sum the gradients of accumulate_games updates and apply their mean
+        # in one optimizer step, clipped to clip_norm if given. Worker threads share the model's one accumulator; it is
+        # built here if none is passed in
+        self.accumulate_games = accumulate_games
+        self.clip_norm = clip_norm
+        self.accumulator = accumulator
+        self.accumulated_games = 0
+        self.accumulated_grads = None # param_store mode accumulates the pushed gradients in numpy instead
+        self.optimizer_steps = 0
+        if self.accumulate_games > 1:
+            if self.trainer is not None:
+                raise ValueError("The GA3C trainer already batches games into one update")
+            if self.param_store is None:
+                if self.accumulator is None:
+                    self.accumulator = GradientAccumulator(self.model, accumulate_games, self.train_value, clip_norm)
+                self.update_fetches = [self.accumulator.accumulate_op] + self.update_fetches[1:]
+
+        # Experience replay (model.replay): every game also goes into the buffer, and each update is followed by enough
+        # V-trace corrected updates on replayed games to replay replay_ratio games per new one
+        self.replay = replay
+        self.replay_ratio = replay_ratio
+        self.replay_batch_size = replay_batch_size
+        self.replay_credit = 0. # games owed to replay
+        if self.replay is not None:
+            if self.trainer is not None or self.param_store is not None:
+                raise ValueError("Replay updates run on the worker's own session")
+            if not (self.naive or self.model.dynamic) and self.replay_batch_size != self.model.batch_size:
+                raise ValueError("The unrolled GRU model replays exactly batch_size ({}) games at once".format(self.model.batch_size))
+
+        # Each worker has an exchange; can be reset to any state. Its state_range, which random starting states (A2C, IMPALA
+        # actors) are drawn from, leaves room to prime states_to_prime states before each game
+        self.exchange = Exchange(data, time_interval=1, game_length=self.t_max, naive_price_history=self.model.input_size,naive_inputs=self.model.inputs_per_time_step,
+                                 gru_prime_length=states_to_prime)
+
+        # Prime once, then play rollouts games from the same state and GRU state as a batch, differing only in the
+        # sampled actions; all of them go into one update, with their mean return as the baseline
+        self.rollouts = rollouts
+        # Synchronous A2C: play sync_games games from different random states in lock-step -- one batched priming run,
+        # one forward pass and one update for all of them, instead of one game per update
+        self.sync_games = sync_games
+        self.rollout_exchange = None
+        if self.rollouts > 1 and self.sync_games > 1:
+            raise ValueError("Play either rollouts from one state or sync_games from different states")
+        games = max(self.rollouts, self.sync_games)
+        if games > 1:
+            if not (self.naive or self.model.dynamic) and games != self.model.batch_size:
+                raise ValueError("The unrolled GRU model plays exactly batch_size ({}) games at once".format(self.model.batch_size))
+            if self.sync_games > 1 and self.predictor is not None:
+                raise ValueError("Synchronous games are already batched; they don't go through a predictor")
+            self.rollout_exchange = VectorizedExchange(self.exchange.market, game_length=self.t_max, number_of_games=games,
+                                                       cash=self.exchange.starting_cash)
 
         # create thread-specific copy of global parameters
         # can load a single model because theta' and theta_v'
@@ -67,18 +160,48 @@ class Worker(Thread):
 
         self.local_model.saver.restore(self.session, model_file)
 
-    def prime_gru(self, sess, input_tensor):
-        initial_state = np.zeros([self.model.batch_size, self.model.layer_size])
+    def prime_gru(self, sess, input_tensor, initial_state=None):
+        if initial_state is None:
+            initial_state = np.zeros([len(input_tensor), self.model.layer_size])
         return sess.run(self.model.network_output, feed_dict={self.model.inputs_ph: input_tensor, self.model.gru_state_ph:initial_state})
 
+    def get_primed_state(self, sess, priming_tensor, initial_state=None):
+        # GRU state after running priming_tensor (BATCH X SEQ X INPUTS), through the predictor in GA3C mode
+        if self.predictor is None:
+            return self.prime_gru(sess, self.model.format_inputs(priming_tensor), initial_state)[1][0]
+        return self.predictor.query(priming_tensor[0], None if initial_state is None else initial_state[0])["state"][None]
+
+    def prime_from_cache(self, sess, starting_states):
+        # Start every game from the state cached at the anchor before its starting state and replay the gap up to it;
+        # returns the primed states and the games' inputs. Anchors that aren't cached are primed first, all in one batch,
+        # and gaps of the same length are replayed as one batch
+        # the first anchors would be primed from before the start of the data, so they move up to states_to_prime
+        anchors = np.array([max(self.state_cache.anchor(state), self.states_to_prime) for state in starting_states])
+        if (anchors > starting_states).any():
+            raise ValueError("Games can't start before state {}, the priming length".format(self.states_to_prime))
+        gaps = starting_states - anchors
+        cached = {anchor: self.state_cache.get(anchor) for anchor in set(anchors.tolist())}
+        missing = [anchor for anchor, state in cached.items() if state is None]
+        if missing:
+            priming_tensor, _ = self.exchange.get_gru_inputs(missing, self.states_to_prime, 0)
+            for anchor, state in zip(missing, self.get_primed_state(sess, priming_tensor)):
+                cached[anchor] = state[None]
+                self.state_cache.put(anchor, cached[anchor])
+
+        states = np.concatenate([cached[anchor] for anchor in anchors.tolist()])
+        for gap in set(gaps.tolist()) - {0}:
+            games = np.flatnonzero(gaps == gap)
+            _, gap_inputs = self.exchange.get_gru_inputs(anchors[games], 0, gap)
+            states[games] = self.get_primed_state(sess, gap_inputs, states[games])
+        _, inputs = self.exchange.get_gru_inputs(starting_states, 0, self.t_max)
+        return states, inputs
+
     def play_game2(self, sess, starting_state=1000):
+        # starting_state - one state, or one per game with sync_games
+        starting_states = np.atleast_1d(starting_state)
+        self.starting_states = starting_states
         self.exchange.reset()
-        previous_value = self.exchange.get_value()
-        self.exchange.goto_state(starting_state)
-        chosen_actions = []
-        rewards = []
-        self.prices = []
-        self.portfolio_values = []
+        self.exchange.goto_state(starting_states[0])
         # Prime e.g. LSTM
 
         if EXPERIMENT:
@@ -86,8 +209,11 @@ class Worker(Thread):
 
         if self.naive:
 
-            input_tensor = self.exchange.get_model_input_naive() # BATCH X SEQ X (Price, Side)
-            self.initial_gru_state = np.zeros([self.model.batch_size, self.model.layer_size]) # just feed it some 0's
+            if len(starting_states) > 1:
+                input_tensor = self.exchange.get_model_input_naive_batch(starting_states, dtype="float32")
+            else:
+                input_tensor = self.exchange.get_model_input_naive() # BATCH X SEQ X (Price, Side)
+            self.initial_gru_state = np.zeros([len(input_tensor), self.model.layer_size]) # just feed it some 0's
 
             # Make sure input is the same
             # if not self.previous is None:
@@ -96,49 +222,43 @@ class Worker(Thread):
             # self.previous = input_tensor
 
         else:
-            # Prime GRU
-            input_tensor = self.exchange.get_model_input(price_range=[starting_state - self.states_to_prime, starting_state], exogenous=True)
-            self.initial_gru_state = self.prime_gru(sess, input_tensor)[1][0]
-            input_tensor = self.exchange.get_model_input(price_range=[starting_state, starting_state + self.t_max], exogenous=True)  # GAME LENGTH X INPUT SIZE
-
-        self.input_tensor = input_tensor
-        self.action_mu, self.action_sd, self.actions, self.state_sequence, self.values = self.model.get_actions_states_values(sess, input_tensor, self.initial_gru_state)  # returns GAME LENGTH X 1 X 2 [-1 to 1, sd]
+            if self.state_cache is not None:
+                self.initial_gru_state, input_tensor = self.prime_from_cache(sess, starting_states)
+            else:
+                # Prime GRU -- priming and game inputs come from one gather, BATCH X SEQ X (Price, Side)
+                priming_tensor, input_tensor = self.exchange.get_gru_inputs(starting_states, self.states_to_prime, self.t_max)
+                self.initial_gru_state = self.get_primed_state(sess, priming_tensor)
+
+        if self.rollouts > 1:
+            # same inputs and starting GRU state for every rollout
+            input_tensor = np.repeat(input_tensor[:1], self.rollouts, axis=0)
+            self.initial_gru_state = np.repeat(self.initial_gru_state[:1], self.rollouts, axis=0)
+
+        self.game_inputs = input_tensor # BATCH X SEQ X INPUTS, before format_inputs
+        self.input_tensor = self.model.format_inputs(input_tensor)
+        if self.predictor is not None:
+            futures = [self.predictor.submit(game, state) for game, state in zip(input_tensor, self.initial_gru_state)]
+            predictions = [future.result() for future in futures]
+            self.action_mu, self.action_sd, self.actions, self.values = [np.stack([prediction[name] for prediction in predictions])
+                                                                         for name in ("action_mu", "action_sd", "actions", "value")]
+            self.state_sequence = None
+        else:
+            if self.reuse_forward:
+                self.handle = self.model.setup_rollout(sess, self.update_fetches)
+            self.action_mu, self.action_sd, self.actions, self.state_sequence, self.values = self.model.get_actions_states_values(sess, self.input_tensor, self.initial_gru_state, handle=self.handle)  # returns GAME LENGTH X 1 X 2 [-1 to 1, sd]
         # final_state = [batch size, 256]
 
-        #print(self.actions)
-        for i in range(0, self.t_max):
-            # get action prediction
-            #print(self.action_mu.shape)
-            mean = self.action_mu[0,i,0]-.5 # BATCH, SEQ, # OF ACTIONS
-            sd = self.action_sd[0,i,0]
-            #print(mean, sd)
-            if self.model.fixed_sd:
-                print("FIXED SD")
-                sd = self.model.fixed_sd
-
-            if EXPERIMENT:
-                mean = self.action_mu[0,i,0]+.5 # ONLY BUY STUFF
-
-            # Sample
-            #print(self.actions.shape) # batch X SEQ x # of actions
-            mean = self.actions[0,i,0]
-            chosen_action = self.exchange.interpret_action(mean, sd, sample = False)
-            #print(chosen_action)
-            self.prices.append(self.exchange.current_price)
-            self.exchange.get_next_state() # go to next state to find reward of that move
-            current_value = self.exchange.get_value()
-            self.portfolio_values.append(current_value)
-            R = current_value - previous_value
-
-            if EXPERIMENT: # sell everything every round
-                self.exchange.interpret_action(-1, 0, sample = False)
-            # Record actions
-            chosen_actions.append(chosen_action)
-            rewards.append(R)
-            previous_value = current_value
-            #self.exchange.get_status()
-
-        self.chosen_actions = np.asarray(chosen_actions).reshape([self.model.batch_size, self.t_max, self.model.number_of_actions])
+        # Actions for the whole game are already known, so play it in one pass (same result as stepping through it)
+        # The model's actions are float32; the exchanges trade in float64
+        # mean = self.action_mu[0,:,0] etc. are not used -- the sampled actions are; sd is irrelevant without sampling
+        # EXPERIMENT: sell everything every round
+        if self.rollout_exchange is not None:
+            self.rollout_exchange.reset()
+            self.prices, self.portfolio_values, rewards, chosen_actions = self.rollout_exchange.simulate_games(self.actions[:,:,0].astype("float64"), start_states=starting_states, liquidate_each_step=EXPERIMENT)
+        else:
+            self.prices, self.portfolio_values, rewards, chosen_actions = self.exchange.simulate_game(self.actions[0,:,0].astype("float64"), liquidate_each_step=EXPERIMENT)
+
+        self.chosen_actions = np.asarray(chosen_actions).reshape([-1, self.t_max, self.model.number_of_actions])
         self.rewards = np.asarray(rewards)
 
         if np.ndim(rewards) < 2: # if no batch dimension
@@ -151,16 +271,14 @@ class Worker(Thread):
             #  Initial state
             # self.state = atari_helpers.atari_make_initial_state(self.sp.process(self.env.reset()))
 
-            self.policy_train_op = self.model.update_policy()
-            self.policy_loss_summary = tf.summary.scalar('policy_loss', self.model.policy_loss)
-
-            self.value_train_op = self.model.update_value()
-            self.value_loss_summary = tf.summary.scalar('value_loss', self.model.value_loss)
-
-            self.summary_writer.graph = self.model.graph
+            if self.summary_writer is not None:
+                self.summary_writer.graph = self.model.graph
 
-            # Initialize model
-            sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+            # Initialize model -- unless whoever started the workers already did (GA3C, several worker threads, distributed)
+            if self.trainer is None and self.init_variables:
+                sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+                if self.accumulator is not None:
+                    sess.run(self.accumulator.reset_op) # also initializes the accumulators
 
             # Add graph
             # self.summary_writer.add_graph(self.summary_writer.graph)
@@ -177,7 +295,8 @@ class Worker(Thread):
                     count_string = count_string[6:end_idx]
 
                     # Copy Parameters from the global networks
-                    #sess.run(self.copy_params_op)
+                    if self.param_store is not None:
+                        copy_params(sess, self.model, self.param_store, self.copy_params_op)
                     # self.loadNetworkFromSnapshot()
 
                     # Pre choose starting states without replacement:
@@ -186,22 +305,34 @@ class Worker(Thread):
 
                     #print("Playing game for {} turns".format(self.t_max))
                     starting_state = np.random.randint(*self.exchange.state_range)
-                    self.play_game2(sess, starting_state=1000)
+                    if self.sync_games > 1:
+                        # a different state for every game
+                        self.play_game2(sess, starting_state=np.random.randint(*self.exchange.state_range, size=self.sync_games))
+                    else:
+                        self.play_game2(sess, starting_state=1000)
 
                     # Update the global ne  tworks
                     #print("Updating parameters")
                     self.global_step = int(count_string)
                     self.update(sess)
+                    self.games_played += len(self.rewards)
 
                     # Write out profits
-                    portfolio_value = self.exchange.get_value()-self.exchange.starting_cash
-                    self.summary_writer.add_summary (self.log_scalar("portfolio", portfolio_value, self.global_step), self.global_step)
+                    portfolio_value = self.get_net_worth()-self.exchange.starting_cash
+                    if self.summary_writer is not None:
+                        self.summary_writer.add_summary (self.log_scalar("portfolio", portfolio_value, self.global_step), self.global_step)
 
 
                     if int(count_string) % 100 == 0:
-                        print("Finished step #{}, net worth {}, value loss {}, policy loss {}".format(int(count_string), self.exchange.get_value(), self.value_loss, self.policy_loss))
+                        print("Finished step #{}, net worth {}, value loss {}, policy loss {}".format(int(count_string), self.get_net_worth(), self.value_loss, self.policy_loss))
                         #print("A Mu {}, A SD {}, An action {}".format(self.policy_loss_dict["actions"][0,:,0], self.policy_loss_dict["sds"][0,:,0],  self.chosen_actions[0,:,0]))
                         print("A Mu {}, A SD {}, An action {}".format(self.policy_loss_dict["actions"][0,0:2,0], self.policy_loss_dict["sds"][0,0:2,0],  self.chosen_actions[0,0:2,0]))
+                        if self.state_cache is not None:
+                            self.state_cache.print_stats()
+                        if self.accumulate_games > 1:
+                            print("{} optimizer steps, {} games per step".format(self.optimizer_steps, self.accumulate_games))
+                        if self.replay is not None:
+                            self.replay.print_stats(self.model.inputs_per_time_step)
 
                         #print("Actions {}".format(self.chosen_actions))
                         #print("Action Mus {}".format(self.policy_loss_dict["actions"]))
@@ -209,7 +340,7 @@ class Worker(Thread):
 
                         #print("Network out {}".format(self.policy_loss_dict["output_list"][0,0:10]))
 
-                    if self.T_max is not None and next(self.T) >= self.T_max:
+                    if self.T_max is not None and self.count_games(self.sync_games) >= self.T_max:
                         tf.logging.info("Reached global step {}. Stopping.".format(self.T))
                         print("Reached global step {}. Stopping.".format(self.T))
                         coord.request_stop()
@@ -219,31 +350,32 @@ class Worker(Thread):
             except tf.errors.CancelledError:
                 return
 
+    def count_games(self, games):
+        # T counts games, and a synchronous batch plays sync_games of them; returns the count after the last
+        for _ in range(games):
+            count = next(self.T)
+        return count
+
+    def get_net_worth(self):
+        # after a game; the mean over the games when several were played
+        if self.rollout_exchange is not None:
+            return self.rollout_exchange.get_value().mean()
+        return self.exchange.get_value()
+
     def update(self, sess):
         # Calculate reward
         # rewards, chosen_actions are: [batch, t]
         # states is batch x T x GRU SIZE
         # input_tensor is batch x T X INPUT_SIZE
 
-        # Accumulate gradients at each time step
-        discounted_rewards = []
-        policy_advantage = []
+        # Copmletely ignore the stupid value net -- no baseline and nothing bootstrapped after the last step
+        values = np.zeros(self.rewards.shape)
+        self.discounted_rewards = discounted_returns(self.rewards, self.model.discount)
+        self.policy_advantage = self.discounted_rewards - values
 
-        rewards_swapped = np.transpose(self.rewards[::-1], [1,0]) # swap batch and seq axes, so SEQ X BATCH; also reverse;
-        values_swapped = np.transpose(self.values[::-1], [1, 0])
-
-        # Copmletely ignore the stupid value net
-        values_swapped = np.zeros((values_swapped.shape))
-        R = values_swapped[0] # get value in last state
-        R = 0
-        for n, r in enumerate(rewards_swapped):
-            R = r + self.model.discount*R
-            discounted_rewards.append(R)
-            policy_advantage.append(R - values_swapped[n])
-
-        # Unreverse and transpose
-        self.discounted_rewards = np.asarray(discounted_rewards[::-1]).transpose([1,0])
-        self.policy_advantage = np.asarray(policy_advantage[::-1]).transpose([1,0])
+        if self.rollouts > 1:
+            # rollouts from the same state: their mean return is the baseline
+            self.policy_advantage = self.policy_advantage - self.discounted_rewards.mean(axis=0, keepdims=True)
 
         if self.global_step % 100==0 and False:
             print("NEW RUN")
@@ -257,37 +389,100 @@ class Worker(Thread):
             import time
             time.sleep(2)
             #Stop
-        self.update_policy(sess)
-
-        if False:
-            self.update_values(sess)
+        self.update_network(sess)
+
+        if self.replay is not None:
+            self.replay.add(self.starting_states, self.initial_gru_state, self.chosen_actions, self.action_mu, self.action_sd, self.rewards)
+            self.replay_credit += self.replay_ratio * len(self.chosen_actions)
+            while self.replay_credit >= self.replay_batch_size and self.replay.size >= self.replay_batch_size:
+                self.replay_update(sess)
+                self.replay_credit -= self.replay_batch_size
+
+    def replay_update(self, sess):
+        # One off-policy update on replayed games; their inputs are gathered again from their starting states
+        indices, games, weights = self.replay.sample(self.replay_batch_size)
+        if self.naive:
+            inputs = self.exchange.get_model_input_naive_batch(games["start_states"], dtype="float32")
         else:
-            self.value_loss = "N/A"
-
-    def update_policy(self, sess):
-        # self.policy_dict, self.model.policy_loss
-        _, loss, self.policy_loss_dict, _ = sess.run([self.policy_train_op, self.policy_loss_summary, self.model.policy_dict, self.model.assert_op], feed_dict={self.model.inputs_ph: self.input_tensor, self.model.gru_state_ph: self.initial_gru_state,
-            self.model.policy_advantage: self.policy_advantage, self.model.chosen_actions: self.chosen_actions})
-        #_, loss = sess.run([self.policy_train_op, self.policy_loss_summary], feed_dict={self.model.inputs_ph: self.input_tensor, self.model.gru_state_ph: self.initial_gru_state,
-            #self.model.policy_advantage: self.policy_advantage, self.model.chosen_actions: self.chosen_actions})
-        self.summary_writer.add_summary(loss, self.global_step)
-
-        #print(np.concatenate((pl["entropy"], pl["mess"]), axis=2))
-        #print(pl["log_prob"])
-        #print(pl["policy_loss"])
-
-        self.policy_loss = self.policy_loss_dict ["policy_loss"]
-        #print("Policy loss: {}".format(policy_loss))
-
-    def update_values(self, sess):
-        _, loss, self.value_loss = sess.run([self.value_train_op, self.value_loss_summary, self.model.value_loss],
-                                       feed_dict={self.model.inputs_ph: self.input_tensor, self.model.gru_state_ph: self.initial_gru_state,self.model.discounted_rewards: self.discounted_rewards})
-        #_, loss = sess.run([self.value_train_op, self.value_loss_summary],
-                                        # feed_dict={self.model.inputs_ph: self.input_tensor, self.model.gru_state_ph: self.initial_gru_state,self.model.discounted_rewards: self.discounted_rewards})
-
-        self.summary_writer.add_summary(loss, self.global_step)
-        #print("Values loss: {}".format(self.value_loss))
-
+            _, inputs = self.exchange.get_gru_inputs(games["start_states"], 0, self.t_max)
+        feed_dict = {self.model.inputs_ph: self.model.format_inputs(inputs)}
+        if not self.naive:
+            feed_dict[self.model.gru_state_ph] = games["gru_states"]
+        add_vtrace_targets(sess, self.model, feed_dict, games["chosen_actions"], games["action_mu"], games["action_sd"],
+                           games["rewards"], self.model.discount)
+        advantages = feed_dict[self.model.policy_advantage]
+        self.replay.update_priorities(indices, np.abs(advantages).mean(axis=1))
+        feed_dict[self.model.policy_advantage] = advantages * weights[:, None] # importance weights of prioritized sampling
+        self.finish_update(sess, sess.run(self.update_fetches, feed_dict=feed_dict))
+
+    def update_network(self, sess):
+        if self.trainer is not None:
+            # hand the game to the trainer, which batches it with other workers' games; losses are from its last update
+            for n in range(len(self.game_inputs)):
+                self.trainer.submit(Experience(self.game_inputs[n], self.initial_gru_state[n], self.chosen_actions[n],
+                                               self.policy_advantage[n], self.discounted_rewards[n]))
+            self.policy_loss, self.value_loss = self.trainer.policy_loss, self.trainer.value_loss
+            self.policy_loss_dict = {"policy_loss": self.policy_loss, "actions": self.action_mu, "sds": self.action_sd}
+            return
+
+        if self.param_store is not None:
+            # local gradients go to the shared parameters; the local copy is refreshed before the next game
+            feed_dict = {self.model.inputs_ph: self.input_tensor, self.model.policy_advantage: self.policy_advantage,
+                         self.model.chosen_actions: self.chosen_actions, self.model.discounted_rewards: self.discounted_rewards}
+            if not self.naive:
+                feed_dict[self.model.gru_state_ph] = self.initial_gru_state
+            grads, self.policy_loss, value_loss = sess.run([self.gradient_ops, self.model.policy_loss, self.model.value_loss], feed_dict=feed_dict)
+            self.value_loss = value_loss if self.train_value else "N/A"
+            self.policy_loss_dict = {"policy_loss": self.policy_loss, "actions": self.action_mu, "sds": self.action_sd}
+            grads = dict(zip(self.gradient_names, grads))
+            if self.accumulate_games > 1:
+                if self.accumulated_grads is None:
+                    self.accumulated_grads = grads
+                else:
+                    self.accumulated_grads = {name: self.accumulated_grads[name] + grad for name, grad in grads.items()}
+                self.accumulated_games += 1
+                if self.accumulated_games < self.accumulate_games:
+                    return
+                grads = {name: grad / self.accumulated_games for name, grad in self.accumulated_grads.items()}
+                if self.clip_norm:
+                    grads = clip_by_global_norm(grads, self.clip_norm)
+                self.accumulated_grads, self.accumulated_games = None, 0
+            self.param_store.apply_gradients(grads)
+            self.optimizer_steps += 1
+            return
+
+        # One session call for the whole update (policy, plus value if train_value)
+        feed_dict = {self.model.policy_advantage: self.policy_advantage, self.model.chosen_actions: self.chosen_actions,
+                     self.model.discounted_rewards: self.discounted_rewards}
+        if self.handle is None:
+            feed_dict[self.model.inputs_ph] = self.input_tensor
+            if not self.naive:
+                feed_dict[self.model.gru_state_ph] = self.initial_gru_state
+            results, self.policy_loss_dict = sess.run([self.update_fetches, self.model.policy_dict], feed_dict=feed_dict)
+        else:
+            # the forward pass already ran on this handle; only the update's own inputs are fed
+            results = sess.partial_run(self.handle, self.update_fetches, feed_dict=feed_dict)
+            self.handle = None
+            self.policy_loss_dict = {"policy_loss": results[2], "actions": self.action_mu, "sds": self.action_sd}
+        self.finish_update(sess, results)
+
+    def finish_update(self, sess, results):
+        # after running update_fetches, on a played or a replayed game
+        if self.accumulator is not None:
+            # the fetches only accumulated the gradients; step every accumulate_games updates, counting every worker's
+            if self.accumulator.add_games():
+                sess.run(self.accumulator.apply_op)
+                self.optimizer_steps += 1
+                if self.state_cache is not None:
+                    self.state_cache.bump_version()
+        else:
+            self.optimizer_steps += 1
+            if self.state_cache is not None:
+                self.state_cache.bump_version()
+        if self.summary_writer is not None:
+            self.summary_writer.add_summary(results[1], self.global_step)
+        self.policy_loss = results[2]
+        self.value_loss = results[3] if self.train_value else "N/A"
 
     def log_scalar(self, tag, value, step):
         """Log a scalar variable.
@@ -0,0 +1,86 @@
+import numpy as np
+
+# One row per bar
+BAR_DTYPE = [("time", "float64"),   # start of the bar, same units as the trade times
+             ("open", "float64"),
+             ("high", "float64"),
+             ("low", "float64"),
+             ("close", "float64"),
+             ("vwap", "float64"),
+             ("volume", "float64"),
+             ("buys", "int64"),
+             ("sells", "int64"),
+             ("count", "int64"),     # number of trades in the bar
+             ("trade", "int64")]     # index of the trade representing the bar (its first trade), -1 if none
+
+def time_bars(times, prices, seconds=60, amounts=None, sides=None, interpolation="repeat"):
+    """ Resample a trade tape into fixed width time bars without looping over trades.
+
+    times must be sorted (the tape is). Trade t falls in bar floor(t / seconds), like round_to_nearest.
+    Every bar between the first and last trade is returned. Bars with no trades are filled according to interpolation:
+        "repeat" - prices are the previous bar's close and trade is the previous bar's trade
+        None     - prices are NaN and trade is -1
+    Volume and buy/sell counts of empty bars are always 0. Without amounts every trade counts as 1 unit of volume.
+    """
+    if interpolation not in ("repeat", None):
+        raise ValueError("Unknown interpolation {}".format(interpolation))
+
+    times = np.asarray(times, dtype="float64")
+    prices = np.asarray(prices, dtype="float64")
+    amounts = np.ones(len(prices)) if amounts is None else np.asarray(amounts, dtype="float64")
+
+    if len(times) == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+
+    buckets = (times // seconds).astype("int64")
+    first_bucket = buckets[0]
+    buckets -= first_bucket
+    number_of_bars = buckets[-1] + 1
+    bar_ids = np.arange(number_of_bars)
+
+    starts = np.searchsorted(buckets, bar_ids, side="left")
+    ends = np.searchsorted(buckets, bar_ids, side="right")
+    counts = ends - starts
+    filled = counts > 0
+    nonempty_starts = starts[filled]
+
+    bars = np.zeros(number_of_bars, dtype=BAR_DTYPE)
+    bars["time"] = (bar_ids + first_bucket) * seconds
+    bars["count"] = counts
+
+    # Consecutive non-empty starts cover the tape, so reduceat gives one max/min per non-empty bar
+    bars["open"][filled] = prices[nonempty_starts]
+    bars["close"][filled] = prices[ends[filled] - 1]
+    bars["high"][filled] = np.maximum.reduceat(prices, nonempty_starts)
+    bars["low"][filled] = np.minimum.reduceat(prices, nonempty_starts)
+    bars["trade"][filled] = nonempty_starts
+
+    volume = np.bincount(buckets, weights=amounts, minlength=number_of_bars)
+    notional = np.bincount(buckets, weights=prices * amounts, minlength=number_of_bars)
+    bars["volume"] = volume
+    bars["vwap"][filled] = notional[filled] / np.where(volume[filled] == 0, 1, volume[filled])
+    if sides is not None:
+        sides = np.asarray(sides)
+        bars["buys"] = np.bincount(buckets[sides == 1], minlength=number_of_bars)
+        bars["sells"] = np.bincount(buckets[sides == 0], minlength=number_of_bars)
+
+    # Gaps
+    empty = ~filled
+    if interpolation == "repeat":
+        # index of the most recent non-empty bar (bar 0 always has a trade)
+        previous = np.maximum.accumulate(np.where(filled, bar_ids, 0))[empty]
+        for field in ("open", "high", "low", "close", "vwap"):
+            bars[field][empty] = bars["close"][previous]
+        bars["trade"][empty] = bars["trade"][previous]
+    else:
+        for field in ("open", "high", "low", "close", "vwap"):
+            bars[field][empty] = np.nan
+        bars["trade"][empty] = -1
+
+    return bars
+
+def bars_from_records(data, seconds=60, interpolation="repeat"):
+    # time_bars for a structured trade array (price/time, and side/amount when the file has them)
+    sides = data["side"] if "side" in data.dtype.names else None
+    amounts = data["amount"] if "amount" in data.dtype.names else None
+    return time_bars(data["time"], data["price"], seconds=seconds, amounts=amounts, sides=sides, interpolation=interpolation)
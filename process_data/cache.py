@@ -0,0 +1,85 @@
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Derived arrays (log prices, resampled bars etc.) are written here, one directory per source file + parameters
+CACHE_DIR = "./tmp/cache"
+# Bump this when the way derived arrays are computed changes, so old entries are ignored
+CACHE_VERSION = 2
+
+def file_hash(path, block_size=2**24):
+    # Content hash of the source data
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            sha.update(block)
+            block = f.read(block_size)
+    return sha.hexdigest()
+
+def source_hash(path, cache_dir=CACHE_DIR):
+    # Hashing a full tape takes a while, so remember the hash for as long as the file's size and mtime don't change
+    stat = os.stat(path)
+    fingerprint = "{}:{}:{}".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    index_path = os.path.join(cache_dir, "sources.json")
+    index = {}
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+        except ValueError:
+            index = {}
+
+    if fingerprint not in index:
+        index[fingerprint] = file_hash(path)
+        write_atomic_json(index_path, index)
+    return index[fingerprint]
+
+def cache_key(path, params, cache_dir=CACHE_DIR):
+    key = json.dumps({"source": source_hash(path, cache_dir), "params": params, "version": CACHE_VERSION}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def write_atomic_json(path, obj):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+def load_or_build(source_path, params, build, cache_dir=CACHE_DIR, mmap_mode="r"):
+    """ Return the dict of arrays build() makes from source_path, memory mapped from the cache when possible.
+
+    params should hold everything build() depends on besides the file contents (e.g. time_interval, dtype).
+    Entries are keyed on a hash of the file contents, so a changed source is rebuilt automatically.
+    With cache_dir=None nothing is cached and build() is simply called.
+    """
+    if cache_dir is None:
+        return build()
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    entry = os.path.join(cache_dir, cache_key(source_path, params, cache_dir))
+    manifest = os.path.join(entry, "manifest.json")
+    if os.path.exists(manifest):
+        with open(manifest, "r") as f:
+            names = json.load(f)["arrays"]
+        return {name: np.load(os.path.join(entry, name + ".npy"), mmap_mode=mmap_mode) for name in names}
+
+    arrays = build()
+
+    # Write to a scratch directory and rename it into place, so concurrent workers never see half an entry
+    scratch = tempfile.mkdtemp(dir=cache_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(scratch, name + ".npy"), array)
+    with open(os.path.join(scratch, "manifest.json"), "w") as f:
+        json.dump({"arrays": list(arrays.keys()), "source": os.path.abspath(source_path), "params": params}, f)
+    try:
+        os.rename(scratch, entry)
+    except OSError:
+        # someone else finished first
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {name: np.load(os.path.join(entry, name + ".npy"), mmap_mode=mmap_mode) for name in arrays}
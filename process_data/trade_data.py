@@ -6,11 +6,21 @@ from io import StringIO
 import csv
 import os
 import shutil
+import tempfile
+import itertools
+import time
 from utils import *
+from bars import bars_from_records
 
 from datetime import datetime
 datetime_object = datetime.strptime('Jun 1 2005  1:33PM', '%b %d %Y %I:%M%p')
 
+# Columnar layout written by convert_csv_to_columns -- one .npy per field, same names as the old structured .npy files
+# amount is the "size" column of the GDAX CSV; time is seconds since 2010-01-01 (see getDateTimeFromISO8601String)
+COLUMNS = [("price", "float64"), ("side", "int8"), ("amount", "float64"), ("time", "float64")]
+CSV_FIELDS = {"price": "price", "side": "side", "amount": "size", "time": "time"}
+CHUNK_ROWS = 500000
+
 
 class TradeData:
     def __init__(self, dataset_path, rows = float("inf")):
@@ -23,14 +33,31 @@ class TradeData:
         # input is loaded as part of model initialization
         print("Loading data...")
         self.data = []
+        self.columns = None
 
-        # Open CSV
+        # Open CSV -- stream it into a column directory next to the CSV once, then memory map that
         if self.input_path[-4:] == ".csv":
-            # self.load_csv()
-
-            # Load as numpy
-            self.data = np.genfromtxt(self.input_path, names="price, side, time", dtype="float64, int, int", delimiter=',',
-                                   usecols=(1, 2, 3), unpack=True, skip_header=1)
+            column_dir = self.input_path[:-4]
+            if not os.path.isdir(column_dir):
+                max_rows = None if self.last_row == float("inf") else int(self.last_row)
+                # Convert into a scratch directory and rename it into place, so an interrupted conversion is never reused
+                scratch = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(column_dir)))
+                try:
+                    convert_csv_to_columns(self.input_path, scratch, max_rows=max_rows)
+                except BaseException:
+                    shutil.rmtree(scratch, ignore_errors=True)
+                    raise
+                try:
+                    os.rename(scratch, column_dir)
+                except OSError:
+                    # someone else finished first
+                    shutil.rmtree(scratch, ignore_errors=True)
+            self.columns = load_columns(column_dir)
+            self.data = columns_to_records(self.columns)
+        # Open a column directory
+        elif os.path.isdir(self.input_path):
+            self.columns = load_columns(self.input_path)
+            self.data = columns_to_records(self.columns)
         # Open a Numpy thing
         else:
             self.data = np.load(self.input_path)
@@ -60,35 +87,113 @@ class TradeData:
         np.save(output_path, self.data)
 
     def generate_prices_at_time(self, seconds = 60):
-        current_time = self.data[0]["time"]
-        target = round_to_nearest(current_time, round_by=seconds)
-        previous_target = target
-        self.prices_at_time = []
-
-        for i in self.data:
-            #print(target, i["time"])
-            if i["time"] > target:
-                target = round_to_nearest(i["time"], seconds)
-                time_steps = int((target-previous_target)/60 )
-                self.prices_at_time += [None]*time_steps + [i["price"]]
-                previous_target = target
-                target += 60
-
-                # iterpolate over missing timesteps?
-                # do nothing?
-
-
+        # Price at the start of each bar, NaN where nothing traded; full OHLC/volume bars are kept in self.bars
+        self.bars = bars_from_records(self.data, seconds=seconds, interpolation=None)
+        self.prices_at_time = self.bars["open"]
+        return self.prices_at_time
+
+
+
+def count_rows(csv_path, block_size=2**24):
+    # Count data rows without parsing anything, so the output columns can be preallocated
+    rows = 0
+    last = b"\n"
+    with open(csv_path, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            rows += block.count(b"\n")
+            last = block[-1:]
+            block = f.read(block_size)
+    if last != b"\n":
+        rows += 1 # no trailing newline
+    return max(rows - 1, 0) # header
+
+def parse_chunk(rows, field_index):
+    # rows is a list of csv rows; returns a dict of arrays, one per column
+    fields = list(zip(*rows))
+    chunk = {}
+    chunk["price"] = np.asarray(fields[field_index["price"]], dtype="float64")
+    chunk["side"] = buy_sell_encoder_batch(fields[field_index["side"]])
+    chunk["amount"] = np.asarray(fields[field_index["amount"]], dtype="float64")
+    chunk["time"] = iso8601_to_seconds(fields[field_index["time"]])
+    return chunk
+
+def convert_csv_to_columns(csv_path, output_dir, chunk_rows=CHUNK_ROWS, max_rows=None, verbose=True):
+    """ Stream a GDAX trade CSV into a directory of memory mappable .npy columns.
+
+    Only chunk_rows rows are held in memory at a time, so peak memory does not depend on the size of the CSV.
+    Returns the number of rows written.
+    """
+    total_rows = count_rows(csv_path)
+    if max_rows is not None:
+        total_rows = min(total_rows, max_rows)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    columns = {}
+    for name, dtype in COLUMNS:
+        columns[name] = np.lib.format.open_memmap(os.path.join(output_dir, name + ".npy"), mode="w+", dtype=dtype, shape=(total_rows,))
+
+    start_time = time.time()
+    written = 0
+    with open(csv_path, "r", newline="") as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        header = next(reader)
+        field_index = {name: header.index(csv_name) for name, csv_name in CSV_FIELDS.items()}
+
+        while written < total_rows:
+            rows = [row for row in itertools.islice(reader, min(chunk_rows, total_rows - written)) if row]
+            if not rows:
+                break
+            chunk = parse_chunk(rows, field_index)
+            for name, column in columns.items():
+                column[written:written + len(rows)] = chunk[name]
+            written += len(rows)
+
+            if verbose:
+                elapsed = time.time() - start_time
+                print("Converted {} / {} rows ({:.0f} rows/sec)".format(written, total_rows, written / max(elapsed, 1e-9)))
+
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    # Blank lines were counted but not written
+    if written < total_rows:
+        for name, dtype in COLUMNS:
+            truncate_column(os.path.join(output_dir, name + ".npy"), written, chunk_rows)
+
+    elapsed = time.time() - start_time
+    print("Wrote {} rows to {} in {:.1f}s ({:.0f} rows/sec)".format(written, output_dir, elapsed, written / max(elapsed, 1e-9)))
+    return written
+
+def truncate_column(path, rows, chunk_rows=CHUNK_ROWS):
+    # Copy the first rows of a column into a new file, chunk by chunk
+    old = np.load(path, mmap_mode="r")
+    tmp_path = path + ".tmp.npy"
+    new = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=old.dtype, shape=(rows,))
+    for start in range(0, rows, chunk_rows):
+        new[start:start + chunk_rows] = old[start:min(start + chunk_rows, rows)]
+    new.flush()
+    del old, new
+    os.replace(tmp_path, path)
+
+def load_columns(column_dir, mmap_mode="r"):
+    # Returns a dict of read only memory mapped columns
+    return {name: np.load(os.path.join(column_dir, name + ".npy"), mmap_mode=mmap_mode) for name, _ in COLUMNS}
+
+def columns_to_records(columns):
+    # Assemble the old structured array (data[n]["price"] etc.) from columns; this does load everything into memory
+    records = np.empty(len(columns["price"]), dtype=[(name, columns[name].dtype) for name in columns])
+    for name, column in columns.items():
+        records[name] = column
+    return records
 
 def create_small_dataset():
     dataset = r"D:\Data\Crypto\GDAX\BTC-USD.csv"
-    new_dataset_name = r"BTC-USD_VERY_SHORT.csv"
-    dataset_out = os.path.join(r"D:\Data\Crypto\GDAX", new_dataset_name)
-    dataset_small = os.path.join(r"./data", new_dataset_name)
-
-    myData = TradeData(dataset, rows = 1000)
-    print(myData.data)
-    myData.write_out(dataset_out)
-    shutil.copy(dataset_out, dataset_small)
+    dataset_small = r"./data/BTC-USD_VERY_SHORT"
+    convert_csv_to_columns(dataset, dataset_small, max_rows=1000)
 
 if __name__ == "__main__":
     #create_small_dataset()
@@ -108,6 +213,10 @@ if __name__ == "__main__":
         myData.generate_prices_at_time()
         print(myData.prices_at_time)
 
+    # Full tape: stream the CSV into ../data/GDAX/BTC-USD/{price,side,amount,time}.npy
+    if False:
+        convert_csv_to_columns(r"../data/GDAX/BTC-USD.csv", r"../data/GDAX/BTC-USD")
+
     freq = 100
     # myData = TradeData(ALL_DATA)
     myData = TradeData(sine_data)
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+from exchange import Exchange, VectorizedExchange, play_step_by_step
+from market_data import get_market_data
+
+# Run from the repo root: python -m unittest test_exchange
+
+DATA = "./data/BTC-USD_VERY_SHORT.npy"
+
+class SimulateGameTest(unittest.TestCase):
+    # simulate_game and simulate_games play a whole game from known actions; they must match playing it step by step
+    def setUp(self):
+        np.random.seed(0)
+        self.exchange = Exchange(DATA, game_length=50, naive_price_history=3, naive_inputs=2)
+        self.start_states = np.random.randint(*self.exchange.state_range, size=4)
+        self.actions = np.random.uniform(-1.2, 1.2, (4, 50)) # some out of range, to be clipped
+
+    def testSimulateGame(self):
+        for permit_short in (False, True):
+            for liquidate_each_step in (False, True):
+                # float64 actions, and the float32 ones the model outputs
+                for start_state, actions in zip(np.tile(self.start_states, 2), np.concatenate([self.actions, self.actions.astype("float32")])):
+                    stepped = Exchange(self.exchange.market, 50, permit_short=permit_short)
+                    values, rewards, chosen_actions = play_step_by_step(stepped, actions, start_state, liquidate_each_step)
+                    simulated = Exchange(self.exchange.market, 50, permit_short=permit_short)
+                    _, simulated_values, simulated_rewards, simulated_actions = simulated.simulate_game(actions, start_state=start_state,
+                                                                                                        liquidate_each_step=liquidate_each_step)
+                    np.testing.assert_array_equal(simulated_values, values)
+                    np.testing.assert_array_equal(simulated_rewards, rewards)
+                    np.testing.assert_array_equal(simulated_actions, chosen_actions)
+                    self.assertEqual((simulated.cash, simulated.holdings, simulated.state), (stepped.cash, stepped.holdings, stepped.state))
+
+    def testSimulateGames(self):
+        for liquidate_each_step, actions in ((False, self.actions), (True, self.actions), (True, self.actions.astype("float32"))):
+            games = VectorizedExchange(self.exchange.market, 50, 4)
+            _, values, rewards, chosen_actions = games.simulate_games(actions, start_states=self.start_states, liquidate_each_step=liquidate_each_step)
+            for n, start_state in enumerate(self.start_states):
+                expected = play_step_by_step(Exchange(self.exchange.market, 50), actions[n], start_state, liquidate_each_step)
+                for result, single in zip((values, rewards, chosen_actions), expected):
+                    np.testing.assert_allclose(result[n], single, rtol=1e-12)
+
+class VectorizedExchangeTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.exchange = Exchange(DATA, game_length=50, naive_price_history=3, naive_inputs=2)
+        self.start_states = np.random.randint(*self.exchange.state_range, size=4)
+        self.actions = np.random.uniform(-1.2, 1.2, (4, 50))
+
+    def testSameAsScalarExchanges(self):
+        # N games at once give what N Exchanges would, whatever the starting balances
+        for cash, holdings, permit_short in ((10000, 0, False), (5000, 2.5, False), (10000, 1, True)):
+            for liquidate_each_step in (False, True):
+                games = VectorizedExchange(self.exchange.market, 50, 4, cash=cash, holdings=holdings, permit_short=permit_short)
+                results = games.simulate_games(self.actions, start_states=self.start_states, liquidate_each_step=liquidate_each_step)
+                for n, start_state in enumerate(self.start_states):
+                    exchange = Exchange(self.exchange.market, 50, cash=cash, holdings=holdings, permit_short=permit_short)
+                    expected = exchange.simulate_game(self.actions[n], start_state=start_state, liquidate_each_step=liquidate_each_step)
+                    for result, single in zip(results, expected):
+                        np.testing.assert_allclose(result[n], single, rtol=1e-12)
+                    self.assertAlmostEqual(games.cash[n], exchange.cash)
+                    self.assertAlmostEqual(games.holdings[n], exchange.holdings)
+
+    def testResetToStartingBalances(self):
+        games = VectorizedExchange(self.exchange.market, 50, 4, cash=5000, holdings=2.5)
+        games.simulate_games(self.actions, start_states=self.start_states)
+        games.reset()
+        np.testing.assert_array_equal(games.cash, 5000)
+        np.testing.assert_array_equal(games.holdings, 2.5)
+
+class GruInputsTest(unittest.TestCase):
+    def testPrimingStaysInTheData(self):
+        # every start in state_range can be primed over gru_prime_length states; anything reaching outside the data raises
+        exchange = Exchange(DATA, 100)
+        self.assertGreaterEqual(exchange.state_range[0], 100)
+        exchange.get_gru_inputs([exchange.state_range[0], exchange.state_range[1] - 1], 100, 100)
+        self.assertRaises(ValueError, exchange.get_gru_inputs, [16], 100, 100)
+        self.assertRaises(ValueError, exchange.get_gru_inputs, [len(exchange.sides) - 50], 100, 100)
+        self.assertEqual(Exchange(DATA, 100, gru_prime_length=300).state_range[0], 300)
+
+class MarketDataTest(unittest.TestCase):
+    def testLoadedMarketData(self):
+        # an exchange on market data that is already loaded shares it, and can't ask for another time interval
+        market = get_market_data(DATA, time_interval=1)
+        self.assertIs(Exchange(market, 50).market, market)
+        self.assertIs(VectorizedExchange(market, 50, 2, time_interval=1).market, market)
+        self.assertRaises(ValueError, Exchange, market, 50, time_interval=60)
+        self.assertRaises(ValueError, VectorizedExchange, get_market_data(DATA), 50, 2, time_interval=1)
+
+if __name__ == "__main__":
+    unittest.main()
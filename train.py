@@ -7,7 +7,16 @@ import threading
 import multiprocessing
 from inspect import getsourcefile
 from model.model import Model
-from model.worker import Worker
+from model.worker import Worker, TRAIN_VALUE
+from model.ga3c import Predictor, Trainer
+from model.state_cache import HiddenStateCache
+from model.replay import ReplayBuffer
+from model.accumulation import GradientAccumulator
+from model.parameter_store import ParameterStore, SharedCounter, start_worker_processes, make_copy_params_op, copy_params
+from model.impala import ActorPool, Learner
+from model.distributed import (make_cluster, worker_device, run_ps, create_session, make_done_op, GameCounter, CheckpointSaver,
+                               launch_local_cluster)
+import time
 import itertools
 import archipack
 
@@ -37,9 +46,9 @@ SHARED_NETWORK_SIZE = 64
 FIXED_SD = 0
 NAIVE_LOOKBACK = 3
 
-# Prime GRU once, run e.g. 10 instances on that
+# Prime GRU once, run e.g. 10 instances on that -- --rollouts 10
 
-if os.environ["COMPUTERNAME"] == 'DALAILAMA':
+if os.environ.get("COMPUTERNAME") == 'DALAILAMA':
     TAYLOR = True
 
     if True: # NAIVE
@@ -66,7 +75,7 @@ if os.environ["COMPUTERNAME"] == 'DALAILAMA':
 tf.flags.DEFINE_string("model_dir", MODEL_DIR, "Directory to write Tensorboard summaries and videos to.")
 tf.flags.DEFINE_string("env", "exchange_v1.0", "Name of game")
 tf.flags.DEFINE_integer("t_max", GAME_MAX_LENGTH, "Number of steps before performing an update")
-tf.flags.DEFINE_integer("max_global_steps", EPOCHS, "Stop training after this many steps in the environment. Defaults to running indefinitely.")
+tf.flags.DEFINE_integer("max_global_steps", EPOCHS, "Stop training after this many games (not optimizer steps). Defaults to running indefinitely.")
 tf.flags.DEFINE_integer("eval_every", 300, "Evaluate the policy every N seconds")
 tf.flags.DEFINE_boolean("reset", False, "If set, delete the existing model directory and start training from scratch.")
 tf.flags.DEFINE_integer("parallelism", None, "Number of threads to run. If not set we run [num_cpu_cores] threads.")
@@ -76,12 +85,36 @@ tf.flags.DEFINE_integer("num_input_types", NUM_INPUTS, "E.g. prices, side, times
 tf.flags.DEFINE_string("data_path", DATA, "Path to .npy input file")
 tf.flags.DEFINE_integer("network_size", SHARED_NETWORK_SIZE, "# of GRU/FC cells/nodes")
 tf.flags.DEFINE_integer("fixed_sd", FIXED_SD, "Set SD instead of learning it")
+tf.flags.DEFINE_integer("state_cache_every", 0, "Cache primed GRU states every N states and warm start games from them; 0 to always prime.")
+tf.flags.DEFINE_integer("state_cache_staleness", 50, "Recompute a cached GRU state after this many parameter updates.")
+tf.flags.DEFINE_integer("rollouts", 1, "Games played from each primed GRU state, as one batch.")
+tf.flags.DEFINE_boolean("processes", False, "Run workers as processes with a shared memory parameter store instead of threads.")
+tf.flags.DEFINE_boolean("ga3c", False, "Batch all workers' forward passes and updates through one predictor and one trainer thread.")
+tf.flags.DEFINE_integer("a2c", 0, "Synchronous A2C: one worker plays this many games from different states in lock-step, one update per batch; 0 for async.")
+tf.flags.DEFINE_integer("accumulate_games", 1, "Sum the gradients of this many games (or batches) into one optimizer step.")
+tf.flags.DEFINE_float("clip_norm", 0., "With --accumulate_games, clip the accumulated gradients to this global norm; 0 to not clip.")
+tf.flags.DEFINE_integer("replay_capacity", 0, "Keep this many games in a replay buffer for off-policy updates; 0 for no replay.")
+tf.flags.DEFINE_float("replay_ratio", 1., "Replayed games per new game, with --replay_capacity.")
+tf.flags.DEFINE_integer("replay_batch_size", 8, "Games per replay update.")
+tf.flags.DEFINE_boolean("prioritized_replay", False, "Replay games by their last advantage instead of uniformly.")
+tf.flags.DEFINE_boolean("impala", False, "Actor processes play with parameter snapshots; one learner trains on batches of their games with V-trace.")
+tf.flags.DEFINE_integer("learner_batch_size", 32, "Games per learner update with --impala.")
+tf.flags.DEFINE_string("job_name", "", "Distributed: 'ps' or 'worker'; needs --ps_hosts and --worker_hosts.")
+tf.flags.DEFINE_integer("task_index", 0, "Distributed: index of this task within its job; worker 0 is the chief.")
+tf.flags.DEFINE_string("ps_hosts", "", "Distributed: comma separated host:port list of parameter servers.")
+tf.flags.DEFINE_string("worker_hosts", "", "Distributed: comma separated host:port list of workers.")
+tf.flags.DEFINE_integer("local_cluster", 0, "Run this many worker tasks (and one ps task) as local processes on localhost ports.")
 
 FLAGS = tf.flags.FLAGS
 
 # Set the number of workers
 NUM_WORKERS = multiprocessing.cpu_count()
 NUM_WORKERS = 1
+if FLAGS.ga3c or FLAGS.processes or FLAGS.impala:
+    # workers only play games here (GA3C, IMPALA actors), or don't share a GIL (processes), so use every core
+    NUM_WORKERS = FLAGS.parallelism or multiprocessing.cpu_count()
+if FLAGS.a2c:
+    NUM_WORKERS = 1 # the parallelism is in the batch of games
 
 
 MODEL_DIR = FLAGS.model_dir
@@ -94,6 +127,17 @@ if FLAGS.reset:
 if not os.path.exists(CHECKPOINT_DIR):
   os.makedirs(CHECKPOINT_DIR)
 
+if FLAGS.local_cluster:
+    # Re-run this script as every task of a localhost cluster, with the rest of the same flags
+    args, skip = [], False
+    for arg in sys.argv[1:]:
+        if not skip and not arg.startswith("--local_cluster") and not arg.startswith("--reset"): # reset once, here
+            args.append(arg)
+        skip = arg == "--local_cluster"
+    launch_local_cluster(os.path.abspath(__file__), FLAGS.local_cluster, args=args)
+    print('DONE')
+    sys.exit(0)
+
 # Initialize saver
 train_dir = os.path.join(MODEL_DIR, "train")
 if TAYLOR:
@@ -105,13 +149,133 @@ if not os.path.exists(train_dir):
 # saver = tf.train.Saver(keep_checkpoint_every_n_hours=0.5, max_to_keep=3)
 
 # Initialize model (value and policy nets)
-m = Model(seq_length=FLAGS.t_max, naive=FLAGS.naive, inputs_per_time_step=(FLAGS.naive_lookback * FLAGS.num_input_types if FLAGS.naive else FLAGS.num_input_types),
-          layer_size=FLAGS.network_size, fixed_sd = FLAGS.fixed_sd)
+model_params = dict(seq_length=FLAGS.t_max, naive=FLAGS.naive, inputs_per_time_step=(FLAGS.naive_lookback * FLAGS.num_input_types if FLAGS.naive else FLAGS.num_input_types),
+                    layer_size=FLAGS.network_size, fixed_sd = FLAGS.fixed_sd)
+if FLAGS.job_name:
+    cluster = make_cluster(FLAGS.ps_hosts, FLAGS.worker_hosts)
+    server = tf.train.Server(cluster, job_name=FLAGS.job_name, task_index=FLAGS.task_index)
+    if FLAGS.job_name == "ps":
+        run_ps(server, cluster, FLAGS.task_index)
+        sys.exit(0)
+    model_params["device"] = worker_device(cluster, FLAGS.task_index)
+m = Model(**model_params)
 
 # Keep track of steps
 global_step = tf.Variable(0, name="global_step", trainable=False)
 T = itertools.count(1)
 
+# One gradient accumulator for the model, shared by its worker threads
+accumulator = None
+if FLAGS.accumulate_games > 1 and not (FLAGS.ga3c or FLAGS.processes or FLAGS.impala):
+    accumulator = GradientAccumulator(m, FLAGS.accumulate_games, TRAIN_VALUE, FLAGS.clip_norm)
+
+if FLAGS.job_name == "worker":
+    # Worker threads of this task train the variables on the ps tasks; the chief owns the checkpoints
+    is_chief = FLAGS.task_index == 0
+    done_op = make_done_op(m, cluster)
+    sess = create_session(server, m, is_chief, CHECKPOINT_DIR)
+    if accumulator is not None:
+        sess.run(accumulator.reset_op) # this task's own accumulators
+    T = GameCounter(sess, m)
+    saver = CheckpointSaver(sess, m, CHECKPOINT_DIR) if is_chief else None
+    workers = [Worker(global_model=m, T=T, T_max=FLAGS.max_global_steps, t_max=FLAGS.t_max, states_to_prime=FLAGS.t_max,
+                      summary_writer=summary_writer if is_chief and worker_id == 0 else None, data=FLAGS.data_path,
+                      rollouts=FLAGS.rollouts, init_variables=False, accumulate_games=FLAGS.accumulate_games, clip_norm=FLAGS.clip_norm,
+                      accumulator=accumulator)
+               for worker_id in range(NUM_WORKERS)]
+    with sess:
+        coord = tf.train.Coordinator()
+        if saver is not None:
+            saver.start()
+        worker_threads = []
+        for worker in workers:
+            t = threading.Thread(target=lambda worker=worker: worker.run(sess, coord))
+            t.start()
+            worker_threads.append(t)
+        coord.join(worker_threads)
+        if saver is not None:
+            saver.stop()
+        print("worker task {}: stopping after {} games".format(FLAGS.task_index, T.value()))
+        sess.run(done_op)
+    summary_writer.close()
+    print('DONE')
+    sys.exit(0)
+
+sess = tf.Session(graph=m.graph)
+
+if FLAGS.processes:
+    # Each process builds its own model and exchange; this one only owns the shared parameters
+    trainable_variables = m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
+    store = ParameterStore(trainable_variables)
+    with sess:
+        with m.graph.as_default():
+            sess.run(tf.global_variables_initializer())
+        latest_checkpoint = tf.train.latest_checkpoint(CHECKPOINT_DIR)
+        if latest_checkpoint:
+            print("Loading model checkpoint: {}".format(latest_checkpoint))
+            m.saver.restore(sess, latest_checkpoint)
+        store.set({v.name: value for v, value in zip(trainable_variables, sess.run(trainable_variables))})
+
+        counter = SharedCounter()
+        start = time.time()
+        worker_params = dict(T_max=FLAGS.max_global_steps, t_max=FLAGS.t_max, states_to_prime=FLAGS.t_max, data=FLAGS.data_path,
+                             rollouts=FLAGS.rollouts, accumulate_games=FLAGS.accumulate_games, clip_norm=FLAGS.clip_norm)
+        processes = start_worker_processes(NUM_WORKERS, store, counter, model_params, worker_params, train_dir=train_dir)
+        for process in processes:
+            process.join()
+        print("{} games in {:.0f}s, {:.1f} games/sec".format(counter.value.value - 1, time.time() - start, (counter.value.value - 1) / (time.time() - start)))
+
+        # Bring the trained parameters back and save them
+        copy_params(sess, m, store, make_copy_params_op(m, store))
+        m.saver.save(sess, os.path.join(CHECKPOINT_DIR, "model"), global_step=store.version)
+    print('DONE')
+    sys.exit(0)
+
+if FLAGS.impala:
+    # Each actor process builds its own model and exchange; this process is the learner
+    store = ParameterStore(m.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES))
+    with sess:
+        with m.graph.as_default():
+            sess.run(tf.global_variables_initializer())
+        latest_checkpoint = tf.train.latest_checkpoint(CHECKPOINT_DIR)
+        if latest_checkpoint:
+            print("Loading model checkpoint: {}".format(latest_checkpoint))
+            m.saver.restore(sess, latest_checkpoint)
+
+        learner = Learner(m, sess, store, batch_size=FLAGS.learner_batch_size, summary_writer=summary_writer)
+        learner.publish()
+        actor_params = dict(t_max=FLAGS.t_max, states_to_prime=FLAGS.t_max, data=FLAGS.data_path, rollouts=FLAGS.rollouts)
+        actors = ActorPool(NUM_WORKERS, store, model_params, actor_params)
+        learner.run(actors, FLAGS.max_global_steps)
+        actors.stop()
+        learner.print_stats(actors)
+        m.saver.save(sess, os.path.join(CHECKPOINT_DIR, "model"), global_step=learner.updates)
+    summary_writer.close()
+    print('DONE')
+    sys.exit(0)
+
+state_cache = None
+if FLAGS.state_cache_every and not FLAGS.naive:
+    state_cache = HiddenStateCache(anchor_every=FLAGS.state_cache_every, max_staleness=FLAGS.state_cache_staleness)
+
+# Replay buffer shared by every worker thread
+replay = None
+if FLAGS.replay_capacity:
+    replay = ReplayBuffer(FLAGS.t_max, number_of_actions=m.number_of_actions, layer_size=m.layer_size, capacity=FLAGS.replay_capacity,
+                          prioritized=FLAGS.prioritized_replay)
+
+# Initialize once, before any worker thread starts -- a worker initializing the graph would reset the others' training
+with m.graph.as_default():
+    sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+if accumulator is not None:
+    sess.run(accumulator.reset_op)
+
+# GA3C: one predictor and one trainer thread shared by every worker
+predictor, trainer = None, None
+if FLAGS.ga3c:
+    predictor = Predictor(m, sess)
+    trainer = Trainer(m, sess, summary_writer=summary_writer, state_cache=state_cache)
+
 # Create workers
 workers = []
 for worker_id in range(NUM_WORKERS):
@@ -122,11 +286,14 @@ for worker_id in range(NUM_WORKERS):
         worker_summary_writer = summary_writer
 
     # Initialize new workers
-    worker = Worker(global_model=m, T=T, T_max=FLAGS.max_global_steps, t_max=FLAGS.t_max, states_to_prime=FLAGS.t_max, summary_writer=worker_summary_writer, data = FLAGS.data_path)
+    worker = Worker(global_model=m, T=T, T_max=FLAGS.max_global_steps, t_max=FLAGS.t_max, states_to_prime=FLAGS.t_max, summary_writer=worker_summary_writer, data = FLAGS.data_path,
+                    predictor=predictor, trainer=trainer, state_cache=state_cache, rollouts=FLAGS.rollouts, sync_games=max(FLAGS.a2c, 1),
+                    accumulate_games=FLAGS.accumulate_games, clip_norm=FLAGS.clip_norm, accumulator=accumulator, replay=replay,
+                    replay_ratio=FLAGS.replay_ratio, replay_batch_size=FLAGS.replay_batch_size, init_variables=False)
     workers.append(worker)
 
 # Have each worker somewhat randomly hop around to different dates
-with tf.Session(graph=m.graph) as sess:
+with sess:
     coord = tf.train.Coordinator()
 
     # Load a previous checkpoint if it exists -- do this HERE OR IN MODEL?
@@ -135,6 +302,10 @@ with tf.Session(graph=m.graph) as sess:
       print("Loading model checkpoint: {}".format(latest_checkpoint))
       m.saver.restore(sess, latest_checkpoint)
 
+    if FLAGS.ga3c:
+        predictor.start()
+        trainer.start()
+
     # Start worker threads
     worker_threads = []
     for worker in workers:
@@ -149,6 +320,14 @@ with tf.Session(graph=m.graph) as sess:
 
     # Wait for all workers to finish
     coord.join(worker_threads)
+    if FLAGS.ga3c:
+        predictor.stop()
+        trainer.stop()
+        print("{} games in {} updates, {:.1f} games/sec".format(trainer.games, trainer.updates, trainer.games_per_second()))
+    if state_cache is not None:
+        state_cache.print_stats()
+    if replay is not None:
+        replay.print_stats(m.inputs_per_time_step)
     summary_writer.close()
 
 print('DONE')